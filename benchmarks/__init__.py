@@ -0,0 +1,10 @@
+"""End-to-end benchmarks of the genotype lookups, without AWS.
+
+- dataset generates a synthetic build38 reference (with merged rsids and
+  multiallelic indels) and hive-partitioned user genome parquet files,
+- stand_ins serves the build38, merged-rsids and genome file ETL metadata tables
+  from memory and the user genome files from the local filesystem,
+- scenarios times athena.get_genotypes over a sweep of panel sizes, file sizes and
+  concurrency levels.
+
+Run with `python -m benchmarks --help`."""
@@ -0,0 +1,86 @@
+import argparse
+import json
+import logging
+from typing import List
+
+from benchmarks import __doc__ as description
+from benchmarks.scenarios import run_benchmarks
+
+
+def int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",")]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks", description=description.split("\n")[0]
+    )
+    parser.add_argument(
+        "--panel-sizes",
+        type=int_list,
+        default=[10, 100, 1000],
+        help="rsids per request",
+    )
+    parser.add_argument(
+        "--file-rows",
+        type=int_list,
+        default=[100_000, 1_000_000],
+        help="rows per user genome file",
+    )
+    parser.add_argument(
+        "--concurrency", type=int_list, default=[1, 4, 16], help="concurrent requests"
+    )
+    parser.add_argument(
+        "--requests", type=int, default=100, help="timed requests per scenario"
+    )
+    parser.add_argument(
+        "--reference-size", type=int, default=20_000, help="sites in build38"
+    )
+    parser.add_argument(
+        "--files", type=int, default=8, help="user genome files of each size"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--cold", action="store_true", help="clear the caches before each request"
+    )
+    parser.add_argument(
+        "--data-dir", help="directory of the generated files (default: a temporary one)"
+    )
+    parser.add_argument(
+        "--output", default="benchmark_results.json", help="JSON file of the results"
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    results = run_benchmarks(
+        panel_sizes=args.panel_sizes,
+        file_rows=args.file_rows,
+        concurrency=args.concurrency,
+        n_requests=args.requests,
+        reference_size=args.reference_size,
+        n_files=args.files,
+        seed=args.seed,
+        cold=args.cold,
+        data_dir=args.data_dir,
+    )
+    print(
+        f"{'panel':>6} {'rows':>9} {'conc':>4} {'p50 ms':>8} {'p99 ms':>8} "
+        f"{'req/s':>8} {'peak RSS MB':>11}"
+    )
+    for result in results["scenarios"]:
+        print(
+            f"{result['panel_size']:>6} {result['file_rows']:>9} "
+            f"{result['concurrency']:>4} {result['p50_ms']:>8.1f} "
+            f"{result['p99_ms']:>8.1f} {result['throughput_rps']:>8.1f} "
+            f"{result['peak_rss_bytes'] / 2**20:>11.0f}"
+        )
+    with open(args.output, "w") as output:
+        json.dump(results, output, indent=2)
+    print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
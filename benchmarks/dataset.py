@@ -0,0 +1,167 @@
+"Synthetic build38 reference and user genome files."
+import os
+import random
+from typing import Dict, List, NamedTuple, Optional
+
+import pyarrow
+import pyarrow.parquet as pq
+
+from variants_lib import Variant
+from variants_lib.variants import variants_from_alleles
+
+CHROMS = [f"chr{i}" for i in range(1, 23)] + ["chrX"]
+BASES = "ACGT"
+# (weight, kind) of the generated reference sites, roughly those of a genotyping panel
+SITE_KINDS = [
+    (70, "snp"),
+    (8, "multiallelic_snp"),
+    (8, "deletion"),
+    (7, "insertion"),
+    (7, "multiallelic_indel"),
+]
+
+
+class ReferenceSite(NamedTuple):
+    rsid: str
+    chrom: str
+    pos: int
+    ref: str
+    alts: List[str]
+    merged_from: Optional[str]  # an older rsid merged into this one
+
+    def variants(self) -> List[Variant]:
+        "The normalized variants of the site, as found in the user genome files."
+        return variants_from_alleles(self.chrom, self.pos, self.ref, self.alts)
+
+
+def _alleles(rng: random.Random, kind: str):
+    ref = rng.choice(BASES)
+    others = [base for base in BASES if base != ref]
+    if kind == "snp":
+        return ref, [rng.choice(others)]
+    if kind == "multiallelic_snp":
+        return ref, rng.sample(others, 2)
+    # left aligned: the repeat unit cannot end with the anchor base
+    unit = "".join(rng.choice(BASES) for _ in range(rng.randint(0, 3)))
+    unit += rng.choice(others)
+    if kind == "deletion":
+        return ref + unit * rng.randint(1, 5), [ref]
+    if kind == "insertion":
+        return ref, [ref + unit * rng.randint(1, 5)]
+    # a short tandem repeat with expansions and contractions, left aligned like
+    # the build38 entries: the alleles share the repeat suffix
+    copies = rng.randint(2, 6)
+    alts = [ref + unit * n for n in range(copies + 2) if n != copies]
+    return ref + unit * copies, rng.sample(alts, rng.randint(2, min(4, len(alts))))
+
+
+def generate_reference(
+    n_sites: int, seed: int = 0, merged_fraction: float = 0.1
+) -> List[ReferenceSite]:
+    "Return n_sites reference sites, spread over the chromosomes."
+    rng = random.Random(seed)
+    kinds = [kind for _, kind in SITE_KINDS]
+    weights = [weight for weight, _ in SITE_KINDS]
+    sites: List[ReferenceSite] = []
+    positions = set()
+    for i in range(n_sites):
+        chrom = rng.choice(CHROMS)
+        pos = rng.randrange(10_000, 100_000_000)
+        while (chrom, pos) in positions:
+            pos += 1
+        positions.add((chrom, pos))
+        ref, alts = _alleles(rng, rng.choices(kinds, weights)[0])
+        merged_from = f"rs{10_000_000 + i}" if rng.random() < merged_fraction else None
+        sites.append(ReferenceSite(f"rs{i + 1}", chrom, pos, ref, alts, merged_from))
+    return sites
+
+
+def build38_items(reference: List[ReferenceSite]) -> List[Dict]:
+    "The items of the build38 table, in the DynamoDB JSON format."
+    return [
+        {
+            "rsid": {"S": site.rsid},
+            "chrom": {"S": site.chrom},
+            "pos": {"N": str(site.pos)},
+            "ref": {"S": site.ref},
+            "alt": {"L": [{"S": alt} for alt in site.alts]},
+        }
+        for site in reference
+    ]
+
+
+def merged_rsids_items(reference: List[ReferenceSite]) -> List[Dict]:
+    "The items of the merged-rsids table, in the DynamoDB JSON format."
+    return [
+        {"rsid": {"S": site.merged_from}, "merged_into": {"S": site.rsid}}
+        for site in reference
+        if site.merged_from is not None
+    ]
+
+
+def parquet_path(bucket: str, file_id: str) -> str:
+    "Same layout as athena.get_parquet_path."
+    return f"{bucket}/user_genome_files/parquets/file_id={file_id}"
+
+
+def _random_gt(rng: random.Random) -> Optional[int]:
+    # mostly called, mostly reference
+    return rng.choices([0, 1, None], [70, 28, 2])[0]
+
+
+def write_genome_file(
+    bucket: str,
+    file_id: str,
+    reference: List[ReferenceSite],
+    n_rows: int,
+    seed: int = 0,
+    n_parts: int = 4,
+    row_group_size: int = 64 * 1024,
+) -> int:
+    """Write a user genome file with the TABLE_COLUMNS columns: one row per variant of
+    the reference sites (one per alternate allele for the multiallelic sites), plus
+    private variants up to n_rows rows, sorted by (chrom, pos) and split into n_parts
+    parquet files. Return the number of rows."""
+    rng = random.Random(seed)
+    rows = []
+    for site in reference:
+        for variant in site.variants():
+            rows.append(
+                (
+                    variant.chrom,
+                    variant.pos,
+                    site.rsid,
+                    variant.ref,
+                    variant.alt,
+                    _random_gt(rng),
+                    _random_gt(rng),
+                )
+            )
+    while len(rows) < n_rows:
+        ref, (alt,) = _alleles(rng, "snp")
+        chrom = rng.choice(CHROMS)
+        pos = rng.randrange(10_000, 100_000_000)
+        rows.append((chrom, pos, None, ref, alt, _random_gt(rng), _random_gt(rng)))
+    rows.sort(key=lambda row: (row[0], row[1]))
+    columns = list(zip(*rows))
+    table = pyarrow.table(
+        {
+            "chrom": pyarrow.array(columns[0], pyarrow.string()),
+            "pos": pyarrow.array(columns[1], pyarrow.int64()),
+            "rsid": pyarrow.array(columns[2], pyarrow.string()),
+            "ref": pyarrow.array(columns[3], pyarrow.string()),
+            "alt": pyarrow.array(columns[4], pyarrow.string()),
+            "gt1": pyarrow.array(columns[5], pyarrow.int8()),
+            "gt2": pyarrow.array(columns[6], pyarrow.int8()),
+        }
+    )
+    base_path = parquet_path(bucket, file_id)
+    os.makedirs(base_path, exist_ok=True)
+    part_size = -(-len(table) // n_parts)
+    for part in range(n_parts):
+        pq.write_table(
+            table.slice(part * part_size, part_size),
+            os.path.join(base_path, f"part-{part:05d}.parquet"),
+            row_group_size=row_group_size,
+        )
+    return len(table)
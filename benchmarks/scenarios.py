@@ -0,0 +1,201 @@
+"Time athena.get_genotypes over a sweep of panel sizes, file sizes and concurrency."
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import itertools
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import tempfile
+import time
+from typing import Dict, List, NamedTuple, Optional
+import uuid
+
+import pyarrow
+
+from benchmarks.dataset import (
+    ReferenceSite,
+    build38_items,
+    generate_reference,
+    merged_rsids_items,
+    write_genome_file,
+)
+from benchmarks.stand_ins import clear_caches, etl_metadata_items, local_aws
+from variants_lib import athena
+
+
+class Scenario(NamedTuple):
+    panel_size: int  # rsids per request
+    file_rows: int  # rows per user genome file
+    concurrency: int  # concurrent requests
+
+
+def percentile(values: List[float], q: float) -> float:
+    "Nearest-rank percentile of the values, q in [0, 100]."
+    ordered = sorted(values)
+    return ordered[max(0, -(-len(ordered) * q // 100) - 1)]
+
+
+def sample_sites(
+    rng: random.Random, reference: List[ReferenceSite], panel_size: int
+) -> List[str]:
+    "Return the rsids of random reference sites, using the merged rsids half the time."
+    return [
+        site.merged_from if site.merged_from and rng.random() < 0.5 else site.rsid
+        for site in rng.sample(reference, panel_size)
+    ]
+
+
+def peak_rss_bytes() -> int:
+    "Peak resident set size of the process."
+    try:
+        # unlike ru_maxrss, VmHWM does not include the peak of the process that
+        # spawned this one
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:  # not Linux
+        pass
+    # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if platform.system() == "Darwin" else maxrss * 1024
+
+
+def run_scenario(
+    scenario: Scenario,
+    reference: List[ReferenceSite],
+    file_ids: List[str],
+    n_requests: int,
+    seed: int = 0,
+    cold: bool = False,
+) -> Dict:
+    """Send n_requests get_genotypes requests, `concurrency` at a time, each for a
+    random panel and a random file. A first round of requests (not timed) warms the
+    caches up, unless `cold`, where the caches are cleared before each request."""
+    rng = random.Random(seed)
+    requests = [
+        (sample_sites(rng, reference, scenario.panel_size), rng.choice(file_ids))
+        for _ in range(n_requests + scenario.concurrency)
+    ]
+    warm_up, requests = (
+        requests[: scenario.concurrency],
+        requests[scenario.concurrency :],
+    )
+
+    def timed_request(request) -> float:
+        sites, file_id = request
+        if cold:
+            clear_caches()
+        start = time.perf_counter()
+        athena.get_genotypes(sites, file_id)
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=scenario.concurrency) as pool:
+        if not cold:
+            list(pool.map(timed_request, warm_up))
+        start = time.perf_counter()
+        latencies = list(pool.map(timed_request, requests))
+        elapsed = time.perf_counter() - start
+    return {
+        **scenario._asdict(),
+        "requests": n_requests,
+        "cold": cold,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "throughput_rps": n_requests / elapsed,
+    }
+
+
+def measure_scenario(
+    scenario: Scenario,
+    bucket: str,
+    reference: List[ReferenceSite],
+    file_ids: List[str],
+    n_requests: int,
+    seed: int = 0,
+    cold: bool = False,
+) -> Dict:
+    """Run the scenario against the files of the bucket, adding the memory high-water
+    marks of the process to its results. Meant to run in a fresh process, so that
+    they are the ones of the scenario."""
+    with local_aws(
+        bucket,
+        build38_items(reference),
+        merged_rsids_items(reference),
+        etl_metadata_items(file_ids),
+    ):
+        result = run_scenario(scenario, reference, file_ids, n_requests, seed, cold)
+    return {
+        **result,
+        "peak_rss_bytes": peak_rss_bytes(),
+        "arrow_peak_bytes": pyarrow.default_memory_pool().max_memory(),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(__file__),
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(
+    panel_sizes: List[int],
+    file_rows: List[int],
+    concurrency: List[int],
+    n_requests: int = 100,
+    reference_size: int = 20_000,
+    n_files: int = 8,
+    seed: int = 0,
+    cold: bool = False,
+    data_dir: Optional[str] = None,
+) -> Dict:
+    """Generate the reference and n_files user genome files of each size, then run
+    every scenario of the sweep, each in its own process (see measure_scenario).
+    Return the results, with their environment."""
+    reference = generate_reference(reference_size, seed)
+    results = []
+    # spawned rather than forked, so that nothing of this process is counted
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory(dir=data_dir) as bucket:
+        for rows in sorted(file_rows):
+            file_ids = [str(uuid.UUID(int=rows * 1000 + i)) for i in range(n_files)]
+            for i, file_id in enumerate(file_ids):
+                write_genome_file(bucket, file_id, reference, rows, seed=seed + i)
+            for panel_size, workers in itertools.product(
+                sorted(panel_sizes), sorted(concurrency)
+            ):
+                scenario = Scenario(panel_size, rows, workers)
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    result = pool.submit(
+                        measure_scenario,
+                        scenario,
+                        bucket,
+                        reference,
+                        file_ids,
+                        n_requests,
+                        seed,
+                        cold,
+                    ).result()
+                logging.info("%s", result)
+                results.append(result)
+    return {
+        "commit": _git_commit(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "pyarrow": pyarrow.__version__,
+        "cpu_count": os.cpu_count(),
+        "reference_size": reference_size,
+        "files_per_size": n_files,
+        "scenarios": results,
+    }
@@ -0,0 +1,102 @@
+"""Local stand-ins for the AWS resources used by variants_lib.
+
+The DynamoDB tables are served from memory, in the style of tests.utils.MockDdbClient
+but with the items indexed by key, and the user genome files are read from the local
+filesystem instead of S3."""
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+import os
+from typing import Any, Dict, Iterator, List, Tuple
+
+from variants_lib import athena, merges, utils, variants
+
+
+class LocalDdbClient:
+    "Stand-in for a dynamodb client (DynamoDB JSON items) keyed by a string."
+
+    def __init__(self, table_name: str, items: List[Dict], key_name: str):
+        self.table_name = table_name
+        self.key_name = key_name
+        self.items = {item[key_name]["S"]: item for item in items}
+
+    def batch_get_item(self, RequestItems):
+        if self.table_name not in RequestItems:
+            return {}
+        keys = RequestItems[self.table_name]["Keys"]
+        result_list = [
+            self.items[key[self.key_name]["S"]]
+            for key in keys
+            if key[self.key_name]["S"] in self.items
+        ]
+        return {"Responses": {self.table_name: result_list}}
+
+    def get_item(self, TableName, Key):
+        assert TableName == self.table_name
+        item = self.items.get(Key[self.key_name]["S"])
+        return {} if item is None else {"Item": item}
+
+
+def etl_metadata_items(file_ids: List[str]) -> List[Dict]:
+    "The items of the genome file ETL metadata table, for ingested files."
+    return [
+        {"file_id": {"S": file_id}, "fetchable": {"BOOL": True}} for file_id in file_ids
+    ]
+
+
+def clear_caches() -> None:
+    "Drop every in-process cache of variants_lib."
+    utils.clear_ddb_clients()
+    merges.canonical_rsids_cache.clear()
+    variants.variants_cache.clear()
+    athena.invalidate_parquet_path()
+    athena.clear_dataset_cache()
+
+
+@contextmanager
+def local_aws(
+    bucket: str,
+    build38_items: List[Dict],
+    merged_rsids_items: List[Dict],
+    etl_items: List[Dict],
+) -> Iterator[None]:
+    """Serve the tables from the given items, and the bucket from the local directory
+    of that name, while in the context. The caches are cleared on entry and exit."""
+    etl_table_name = "user-genome-file-etl"
+    clients = {
+        "build38": LocalDdbClient(variants.TABLE_NAME, build38_items, "rsid"),
+        "merged-rsids": LocalDdbClient(merges.TABLE_NAME, merged_rsids_items, "rsid"),
+    }
+    etl_client = LocalDdbClient(etl_table_name, etl_items, "file_id")
+
+    def assume_role_ddb_client(role):
+        return clients[role], datetime.now(timezone.utc) + timedelta(days=1)
+
+    patches: List[Tuple[Any, str, Any]] = [
+        (utils, "_assume_role_ddb_client", assume_role_ddb_client),
+        (athena, "_get_dynamodb_client", lambda: etl_client),
+        (athena, "FILESYSTEM", "local"),
+        # the lookups must go to the tables rather than to local copies
+        (variants, "INDEX_PATH", None),
+        (merges, "SNAPSHOT_PATH", None),
+    ]
+    environ = {
+        "USER_GENOME_FILE_ETL_DDB": etl_table_name,
+        "USER_GENOME_FILE_ETL_BUCKET": os.path.abspath(bucket),
+    }
+    saved_patches = [(obj, name, getattr(obj, name)) for obj, name, _ in patches]
+    saved_environ = {name: os.environ.get(name) for name in environ}
+    for obj, name, value in patches:
+        setattr(obj, name, value)
+    os.environ.update(environ)
+    clear_caches()
+    try:
+        yield
+    finally:
+        clear_caches()
+        for obj, name, value in saved_patches:
+            setattr(obj, name, value)
+        for name, value in saved_environ.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
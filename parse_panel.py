@@ -8,20 +8,53 @@ The JSON schema for the input data is
  - `alt`: string
 The script loads all the loci in memory before unstacking the multiallelic sites,
  because of that it deals with the chromosomes separately (in order to avoid OOM issues).
+The input files are read once: their rows are routed to per-chromosome spill files
+ (buffered in memory up to `--buffer-rows` rows), which are then loaded one chromosome
+ at a time. `--multi-pass` instead reads all the input files again for each chromosome.
+With `--workers`, the input files are partitioned and the chromosomes classified by
+ that many processes (each worker holds one chromosome in memory). Each chromosome
+ is written to its own shard, the shards are then concatenated in chromosome order.
 The output is a single json.gz file containing all the input data with the alleles unstacked
 (for multilallelic sites) and a `type` field containing the variant type.
+With `--format parquet`, the output is instead an `output.parquet` dataset partitioned by
+ chromosome (`chrom=chr1/part-0.parquet`, ...), with the rows sorted by position, the
+ alleles as a list of ref/alt structs and a dictionary-encoded `type` column.
 """
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 import json
 from collections import defaultdict
 import gzip
 import os
+import shutil
+import tempfile
 
-from variants_lib.format_variants import detect_variation_type
+import pyarrow
+import pyarrow.parquet as pq
+
+from variants_lib.format_variants import detect_variation_types_from_offsets
 
 BASE_DIR = os.path.dirname(__file__)
 DATA_DIR = os.path.join(BASE_DIR, "data")
 
 CHROM_LIST = [f"chr{i}" for i in range(1, 23)] + ["chrX"]
+CHROM_SET = set(CHROM_LIST)
+
+PARQUET_SCHEMA = pyarrow.schema(
+    [
+        ("pos", pyarrow.int64()),
+        ("type", pyarrow.dictionary(pyarrow.int8(), pyarrow.string())),
+        (
+            "alleles",
+            pyarrow.list_(
+                pyarrow.struct([("ref", pyarrow.string()), ("alt", pyarrow.string())])
+            ),
+        ),
+    ]
+)
+# Small enough for the pos statistics of the row groups to prune most of a chromosome
+# on a position filter, large enough to keep the footer and per-group overhead low.
+PARQUET_ROW_GROUP_SIZE = 128 * 1024
 
 
 def load_chrom_data(
@@ -39,27 +72,224 @@ def load_chrom_data(
     return d
 
 
+def spill_path(spill_dir: str, chrom: str, shard: str) -> str:
+    return os.path.join(spill_dir, chrom, f"{shard}.tsv")
+
+
+def partition_file(file: str, spill_dir: str, shard: str, buffer_rows: int) -> None:
+    """Route the rows of an input file to one spill file per chromosome, as
+    tab-separated pos/ref/alt lines. At most `buffer_rows` rows are kept in memory."""
+    buffers: dict[str, list[str]] = defaultdict(list)
+    buffered = 0
+
+    def flush():
+        for chrom, lines in buffers.items():
+            with open(spill_path(spill_dir, chrom, shard), "a") as spill:
+                spill.writelines(lines)
+        buffers.clear()
+
+    print(f"Loading data from {file}")
+    for row in map(json.loads, gzip.open(os.path.join(BASE_DIR, DATA_DIR, file))):
+        if row["chrom"] not in CHROM_SET:
+            continue
+        buffers[row["chrom"]].append(f'{row["pos"]}\t{row["ref"]}\t{row["alt"]}\n')
+        buffered += 1
+        if buffered >= buffer_rows:
+            flush()
+            buffered = 0
+    flush()
+
+
+def partition_files(
+    file_list: list[str], spill_dir: str, buffer_rows: int, pool=None
+) -> None:
+    "Read every input file once, routing its rows to the spill files."
+    for chrom in CHROM_LIST:
+        os.makedirs(os.path.join(spill_dir, chrom), exist_ok=True)
+    shards = [f"{i:06d}" for i in range(len(file_list))]
+    n = len(file_list)
+    # each file gets its own spill files, so they can be partitioned in parallel
+    list(
+        (pool.map if pool else map)(
+            partition_file, file_list, [spill_dir] * n, shards, [buffer_rows] * n
+        )
+    )
+
+
+def load_chrom_spills(
+    file_list: list[str], spill_dir: str, chrom: str
+) -> dict[int, list[tuple[str, str]]]:
+    """Same as load_chrom_data, reading the spill files written by partition_files
+    (in the order of the input files)."""
+    d: dict[int, list[tuple[str, str]]] = defaultdict(list)
+    for i in range(len(file_list)):
+        path = spill_path(spill_dir, chrom, f"{i:06d}")
+        if not os.path.exists(path):
+            continue
+        with open(path) as spill:
+            for line in spill:
+                pos, ref, alt = line.rstrip("\n").split("\t")
+                d[int(pos)].append((ref, alt))
+    return d
+
+
+def classify_loci(loci_alleles: list[list[tuple[str, str]]]) -> list[str]:
+    """Return the variation type name of each locus, classifying all the loci at
+    once (see detect_variation_type)."""
+    if not loci_alleles:
+        return []
+    offsets = [0]
+    for alleles in loci_alleles:
+        offsets.append(offsets[-1] + len(alleles))
+    refs = pyarrow.array(
+        [ref for alleles in loci_alleles for ref, _ in alleles], pyarrow.string()
+    )
+    alts = pyarrow.array(
+        [alt for alleles in loci_alleles for _, alt in alleles], pyarrow.string()
+    )
+    return detect_variation_types_from_offsets(refs, alts, offsets).to_pylist()
+
+
+def write_chrom(
+    chrom: str, data: dict[int, list[tuple[str, str]]], output_path: str
+) -> None:
+    loci = list(data)
+    types = classify_loci([data[locus] for locus in loci])
+    with gzip.open(output_path, "at", newline="\n") as output:
+        for locus, type in zip(loci, types):
+            output.write(
+                json.dumps(
+                    {
+                        "chrom": chrom,
+                        "pos": locus,
+                        "type": type,
+                        "alleles": data[locus],
+                    }
+                )
+                + "\n"
+            )
+
+
+def write_chrom_parquet(
+    chrom: str,
+    data: dict[int, list[tuple[str, str]]],
+    output_dir: str,
+    row_group_size: int,
+) -> None:
+    "Write the chromosome partition of the parquet dataset, sorted by position."
+    loci = sorted(data)
+    types = classify_loci([data[locus] for locus in loci])
+    table = pyarrow.table(
+        {
+            "pos": pyarrow.array(loci, pyarrow.int64()),
+            "type": pyarrow.array(types, pyarrow.string()).dictionary_encode(),
+            "alleles": [
+                [{"ref": ref, "alt": alt} for ref, alt in data[locus]] for locus in loci
+            ],
+        }
+    ).cast(PARQUET_SCHEMA)
+    partition_dir = os.path.join(output_dir, f"chrom={chrom}")
+    os.makedirs(partition_dir, exist_ok=True)
+    pq.write_table(
+        table,
+        os.path.join(partition_dir, "part-0.parquet"),
+        row_group_size=row_group_size,
+        use_dictionary=["type"],
+    )
+
+
+def process_chrom(
+    files: list[str],
+    spill_dir: str,
+    chrom: str,
+    multi_pass: bool,
+    output_format: str = "json",
+    row_group_size: int = PARQUET_ROW_GROUP_SIZE,
+) -> str:
+    """Load, classify and write a chromosome to its own shard (or to its partition of
+    the parquet dataset). Return the shard path."""
+    print("Loading data for chrom {0}".format(chrom))
+    if multi_pass:
+        data = load_chrom_data(files, chrom)
+    else:
+        data = load_chrom_spills(files, spill_dir, chrom)
+    print(f"All data loaded for chrom {chrom}.")
+    if output_format == "parquet":
+        write_chrom_parquet(chrom, data, "output.parquet", row_group_size)
+        return ""
+    shard_path = os.path.join(spill_dir, f"output-{chrom}.json.gz")
+    write_chrom(chrom, data, shard_path)
+    return shard_path
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "--multi-pass",
+        action="store_true",
+        help="read all the input files again for each chromosome (no spill files)",
+    )
+    parser.add_argument(
+        "--buffer-rows",
+        type=int,
+        default=1_000_000,
+        help="rows kept in memory before being written to the spill files",
+    )
+    parser.add_argument(
+        "--spill-dir", help="directory of the spill files (default: a temporary one)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of worker processes (e.g. the number of cores)",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["json", "parquet"],
+        default="json",
+        help="write output.json.gz, or the output.parquet dataset",
+    )
+    parser.add_argument(
+        "--row-group-size",
+        type=int,
+        default=PARQUET_ROW_GROUP_SIZE,
+        help="rows per row group of the parquet output",
+    )
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
     files = os.listdir(DATA_DIR)
     print(f"Found {len(files)} files.")
-    for chrom in CHROM_LIST:
-        print("Loading data for chrom {0}".format(chrom))
-        data = load_chrom_data(files, chrom)
-        print("All data loaded.")
-        with gzip.open("output.json.gz", "at", newline="\n") as output:
-            for locus in data:
-                type = detect_variation_type(data[locus]).name
-                output.write(
-                    json.dumps(
-                        {
-                            "chrom": chrom,
-                            "pos": locus,
-                            "type": type,
-                            "alleles": data[locus],
-                        }
-                    )
-                    + "\n"
-                )
+    pool = ProcessPoolExecutor(args.workers) if args.workers > 1 else None
+    try:
+        with tempfile.TemporaryDirectory(dir=args.spill_dir) as spill_dir:
+            if not args.multi_pass:
+                partition_files(files, spill_dir, args.buffer_rows, pool)
+            n = len(CHROM_LIST)
+            shard_paths = (pool.map if pool else map)(
+                process_chrom,
+                [files] * n,
+                [spill_dir] * n,
+                CHROM_LIST,
+                [args.multi_pass] * n,
+                [args.format] * n,
+                [args.row_group_size] * n,
+            )
+            if args.format == "parquet":
+                list(shard_paths)  # the partitions are written by the workers
+            else:
+                # the shards are gzip members, concatenated in chromosome order
+                with open("output.json.gz", "ab") as output:
+                    for shard_path in shard_paths:
+                        with open(shard_path, "rb") as shard:
+                            shutil.copyfileobj(shard, output)
+                        os.remove(shard_path)
+    finally:
+        if pool:
+            pool.shutdown()
     print("All done")
 
 
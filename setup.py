@@ -3,7 +3,7 @@ import setuptools
 setuptools.setup(
     version="1.1.0",
     name="variants_lib",
-    packages=setuptools.find_packages(),
+    packages=setuptools.find_packages(exclude=["benchmarks", "benchmarks.*"]),
     long_description="",
     long_description_content_type="text",
     license="",
@@ -0,0 +1,12 @@
+from pytest import fixture
+from variants_lib import merges, variants
+
+
+@fixture(autouse=True)
+def clear_lookup_caches():
+    "The lookup caches would otherwise leak the mocked tables from test to test."
+    merges.canonical_rsids_cache.clear()
+    variants.variants_cache.clear()
+    yield
+    merges.canonical_rsids_cache.clear()
+    variants.variants_cache.clear()
@@ -0,0 +1,102 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from pytest import fixture
+import pyarrow
+import pyarrow.dataset as ds
+from variants_lib import aio, athena, merges, Locus, Variant
+from variants_lib import variants as variants_module
+
+
+@fixture(autouse=True)
+def mock_lookups(monkeypatch):
+    batches = []
+
+    def canonical_rsids_mock(rsids):
+        batches.append(("merged-rsids", len(rsids)))
+        return {rsid: {"rs123": "rs456"}.get(rsid, rsid) for rsid in rsids}
+
+    def get_variants_mock(rsids, normalized=True):
+        batches.append(("build38", len(rsids)))
+        variants = {"rs456": [Variant(chrom="chr1", pos=1001, ref="A", alt="G")]}
+        return {rsid: variants[rsid] for rsid in rsids if rsid in variants}
+
+    def get_parquet_path_mock(file_id):
+        return None if file_id == "not-ingested" else f"bucket/{file_id}"
+
+    dataset = ds.dataset(
+        pyarrow.table(
+            {
+                "chrom": ["chr1"],
+                "pos": [1001],
+                "rsid": ["rs456"],
+                "ref": ["A"],
+                "alt": ["G"],
+                "gt1": [0],
+                "gt2": [1],
+            }
+        )
+    )
+    monkeypatch.setattr(merges, "canonical_rsids", canonical_rsids_mock)
+    monkeypatch.setattr(variants_module, "get_variants", get_variants_mock)
+    monkeypatch.setattr(athena, "get_parquet_path", get_parquet_path_mock)
+    monkeypatch.setattr(athena, "read_dataset", lambda path: dataset)
+    yield batches
+
+
+def test_canonical_rsids():
+    result = asyncio.run(aio.canonical_rsids(["rs123", "rs7"]))
+    assert result == {"rs123": "rs456", "rs7": "rs7"}
+
+
+def test_get_genotypes_lookups(mock_lookups):
+    asyncio.run(aio.get_genotypes(["rs123", "rs7"], "f1"))
+    assert mock_lookups == [("merged-rsids", 2), ("build38", 2)]
+
+
+def test_get_genotypes():
+    result = asyncio.run(aio.get_genotypes(["rs123"], "f1"))
+    ((locus, (v1, v2)),) = result.items()
+    assert locus == Locus("chr1", 1001, "rs123")
+    assert (v1.genotype, v2.genotype) == ("A", "G")
+
+
+def test_get_genotypes_not_ingested():
+    assert asyncio.run(aio.get_genotypes(["rs123"], "not-ingested")) is None
+
+
+def test_get_genotypes_raw_invalid_site():
+    with pytest.raises(ValueError):
+        asyncio.run(aio.get_genotypes_raw(["123"], "f1"))
+    assert asyncio.run(aio.get_genotypes_raw(["123"], "not-ingested")) is None
+
+
+def test_get_genotypes_timeout(monkeypatch):
+    async def slow_endow(sites):
+        await asyncio.sleep(5)
+
+    monkeypatch.setattr(aio, "endow_rsid_with_variant", slow_endow)
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(aio.get_genotypes(["rs123"], "f1", timeout=0.05))
+
+
+def test_executor():
+    class CountingExecutor(ThreadPoolExecutor):
+        def __init__(self):
+            super().__init__(max_workers=2)
+            self.calls = []
+
+        def submit(self, fn, *args, **kwargs):
+            self.calls.append(fn.func.__name__)
+            return super().submit(fn, *args, **kwargs)
+
+    executor = CountingExecutor()
+    aio.set_executor(executor)
+    try:
+        asyncio.run(aio.get_genotypes(["rs123"], "f1"))
+    finally:
+        aio.set_executor(None)
+        executor.shutdown()
+    # the formatting does not block the event loop either
+    assert executor.calls[-1] == "format_raw_gt"
+    assert len(executor.calls) == 6
@@ -1,6 +1,10 @@
+import random
+import threading
 from pytest import fixture
 import pytest
-from variants_lib import athena, Variant
+import pyarrow
+import pyarrow.dataset as ds
+from variants_lib import athena, utils, Locus, Variant
 
 
 @fixture
@@ -134,3 +138,392 @@ class TestExtractGt:
             Variant(chrom="chr1", pos=1002, ref="C", alt="T", rsid="rs999"): (1, 0),
             Variant(chrom="chr1", pos=1002, ref="C", alt="G", rsid="rs999"): (0, 1),
         }
+
+
+@fixture
+def genotypes_dataset():
+    table = pyarrow.table(
+        {
+            "chrom": ["chr1", "chr1", "chr1", "chr2", "chr2"],
+            "pos": [1001, 1002, 1002, 1001, 2002],
+            "rsid": ["rs456", "rs999", "rs999", None, None],
+            "ref": ["A", "C", "C", "T", "A"],
+            "alt": ["G", "T", "G", "C", "G"],
+            "gt1": [0, 1, 0, 1, 0],
+            "gt2": [1, 0, 1, 1, 0],
+        }
+    )
+    return ds.dataset(table)
+
+
+@pytest.mark.parametrize("mode", ["isin", "or_chain"])
+def test_get_filter(genotypes_dataset, mode):
+    variants = [
+        Variant(chrom="chr1", pos=1002, ref="C", alt="T"),
+        Variant(chrom="chr2", pos=1001, ref="T", alt="C"),
+        Variant(chrom="chr2", pos=3003, ref="A", alt="G"),
+    ]
+    table = genotypes_dataset.to_table(filter=athena.get_filter(variants, mode))
+    assert sorted(zip(table["chrom"].to_pylist(), table["pos"].to_pylist())) == [
+        ("chr1", 1002),
+        ("chr1", 1002),
+        ("chr2", 1001),
+    ]
+
+
+def test_get_filter_invalid_mode():
+    with pytest.raises(ValueError):
+        athena.get_filter([], "scan")
+
+
+def test_get_raw_gt(genotypes_dataset):
+    variants = [
+        Variant(chrom="chr1", pos=1001, ref="A", alt="G", rsid="rs123"),
+        Variant(chrom="chr1", pos=1002, ref="C", alt="G", rsid="rs999"),
+        Variant(chrom="chr2", pos=2002, ref="A", alt="T"),
+    ]
+    assert athena.get_raw_gt(variants, genotypes_dataset) == {
+        Variant(chrom="chr1", pos=1001, ref="A", alt="G", rsid="rs123"): (0, 1),
+        Variant(chrom="chr1", pos=1002, ref="C", alt="G", rsid="rs999"): (0, 1),
+    }
+
+
+def test_format_raw_gt():
+    raw_gt = {
+        Variant(chrom="chr1", pos=1001, ref="A", alt="G", rsid="rs123"): (0, 1),
+        Variant(chrom="chr2", pos=2002, ref="AG", alt="A", rsid="rs777"): (0, 0),
+        Variant(chrom="chr2", pos=2002, ref="A", alt="AGG", rsid="rs777"): (1, 0),
+    }
+    result = athena.format_raw_gt(raw_gt)
+    formatted = {
+        locus: tuple((v.ref, v.alt, v.rsid, v.genotype) for v in pair)
+        for locus, pair in result.items()
+    }
+    assert formatted == {
+        Locus("chr1", 1001, "rs123"): (
+            ("A", "G", "rs123", "A"),
+            ("A", "G", "rs123", "G"),
+        ),
+        Locus("chr2", 2002, "rs777"): (
+            ("A", "AGG", "rs777", "I"),
+            ("A", "", "rs777", "A"),
+        ),
+    }
+
+
+def test_read_dataset_is_cached(monkeypatch):
+    calls = []
+
+    def dataset_mock(base_path, **kwargs):
+        calls.append(base_path)
+        return object()
+
+    athena.clear_dataset_cache()
+    monkeypatch.setattr(athena, "get_s3_filesystem", lambda: None)
+    monkeypatch.setattr(athena.ds, "dataset", dataset_mock)
+    dataset = athena.read_dataset("bucket/file_id=1")
+    assert athena.read_dataset("bucket/file_id=1") is dataset
+    assert athena.read_dataset("bucket/file_id=2") is not dataset
+    assert calls == ["bucket/file_id=1", "bucket/file_id=2"]
+    athena.clear_dataset_cache()
+
+
+def test_read_dataset_filesystem(tmp_path, genotypes_dataset):
+    base_path = tmp_path / "parquets" / "file_id=1"
+    base_path.mkdir(parents=True)
+    ds.write_dataset(genotypes_dataset, base_path, format="parquet")
+    athena.clear_dataset_cache()
+    local = athena.read_dataset(str(base_path), "local")
+    assert local.filesystem.equals(athena.get_local_filesystem())
+    assert local.to_table().num_rows == 5
+    assert athena.read_dataset(str(base_path), "local") is local
+    uri = athena.read_dataset(str(base_path), "file:///")
+    assert uri is not local
+    assert uri.to_table().num_rows == 5
+    filesystem = athena.fs.LocalFileSystem()
+    assert athena.read_dataset(str(base_path), filesystem).filesystem.equals(filesystem)
+    athena.clear_dataset_cache()
+
+
+def test_read_dataset_default_filesystem(tmp_path, genotypes_dataset, monkeypatch):
+    ds.write_dataset(genotypes_dataset, tmp_path, format="parquet")
+    monkeypatch.setattr(athena, "FILESYSTEM", "local")
+    athena.clear_dataset_cache()
+    variants = [Variant(chrom="chr1", pos=1001, ref="A", alt="G", rsid="rs123")]
+    assert athena.get_raw_gt(variants, athena.read_dataset(str(tmp_path))) == {
+        variants[0]: (0, 1)
+    }
+    athena.clear_dataset_cache()
+
+
+@pytest.mark.usefixtures("canonical_rsids_mock", "get_variants_mock")
+def test_scan_after_reingestion(tmp_path, genotypes_dataset, monkeypatch):
+    base_path = tmp_path / "file_id=f1"
+    ds.write_dataset(genotypes_dataset, base_path, format="parquet")
+    monkeypatch.setattr(athena, "FILESYSTEM", "local")
+    monkeypatch.setattr(athena, "get_parquet_path", lambda file_id: str(base_path))
+    athena.clear_dataset_cache()
+    expected = {Variant(chrom="chr1", pos=1001, ref="A", alt="G", rsid="rs123"): (0, 1)}
+    assert athena.get_genotypes_raw(["rs123"], "f1") == expected
+    # the cached dataset lists files that no longer exist
+    for path in base_path.iterdir():
+        path.unlink()
+    ds.write_dataset(
+        genotypes_dataset, base_path, format="parquet", basename_template="new-{i}"
+    )
+    assert athena.get_genotypes_raw(["rs123"], "f1") == expected
+    athena.clear_dataset_cache()
+
+
+class TestParquetPath:
+    ITEMS = {
+        "f1": {"file_id": {"S": "f1"}, "fetchable": {"BOOL": True}},
+        "f2": {"file_id": {"S": "f2"}, "fetchable": {"BOOL": False}},
+    }
+
+    @fixture(autouse=True)
+    def mock_etl_metadata_table(self, monkeypatch):
+        test = self
+        test.get_item_calls = []
+        test.batch_get_item_calls = []
+        test.unprocessed = False
+
+        class ClientMock:
+            def get_item(self, TableName, Key):
+                assert TableName == "etl-table"
+                test.get_item_calls.append(Key["file_id"]["S"])
+                return {"Item": test.ITEMS[Key["file_id"]["S"]]}
+
+            def batch_get_item(self, RequestItems):
+                keys = RequestItems["etl-table"]["Keys"]
+                test.batch_get_item_calls.append([key["file_id"]["S"] for key in keys])
+                if test.unprocessed:  # throttled
+                    return {"UnprocessedKeys": RequestItems}
+                items = [
+                    test.ITEMS[key["file_id"]["S"]]
+                    for key in keys
+                    if key["file_id"]["S"] in test.ITEMS
+                ]
+                return {"Responses": {"etl-table": items}}
+
+        monkeypatch.setenv("USER_GENOME_FILE_ETL_DDB", "etl-table")
+        monkeypatch.setenv("USER_GENOME_FILE_ETL_BUCKET", "bucket")
+        monkeypatch.setattr(athena, "_get_dynamodb_client", ClientMock)
+        athena.invalidate_parquet_path()
+        yield
+        athena.invalidate_parquet_path()
+
+    def test_only_fetchable_files_are_cached(self):
+        path = "bucket/user_genome_files/parquets/file_id=f1"
+        assert athena.get_parquet_path("f1") == path
+        assert athena.get_parquet_path("f1") == path
+        assert athena.get_parquet_path("f2") is None
+        assert athena.get_parquet_path("f2") is None
+        assert self.get_item_calls == ["f1", "f2", "f2"]
+
+    def test_invalidate(self):
+        athena.get_parquet_path("f1")
+        athena.invalidate_parquet_path("f1")
+        athena.get_parquet_path("f1")
+        assert self.get_item_calls == ["f1", "f1"]
+
+    def test_invalidate_drops_datasets(self):
+        path = "bucket/user_genome_files/parquets/file_id=f1"
+        athena._datasets.set((path, "s3"), "dataset")
+        athena._datasets.set((path + "0", "s3"), "other dataset")
+        athena.invalidate_parquet_path("f1")
+        assert athena._datasets.keys() == [(path + "0", "s3")]
+        athena.invalidate_parquet_path()
+        assert athena._datasets.keys() == []
+
+    def test_get_parquet_paths(self):
+        athena.get_parquet_path("f1")
+        assert athena.get_parquet_paths(["f1", "f2", "f3", "f2"]) == {
+            "f1": "bucket/user_genome_files/parquets/file_id=f1",
+            "f2": None,
+            "f3": None,
+        }
+        assert self.batch_get_item_calls == [["f2", "f3"]]
+
+    def test_get_parquet_paths_throttled(self, monkeypatch):
+        monkeypatch.setattr(utils.time, "sleep", lambda delay: None)
+        self.unprocessed = True
+        with pytest.raises(RuntimeError):
+            athena.get_parquet_paths(["f1"])
+        assert len(self.batch_get_item_calls) == utils.BATCH_GET_MAX_ATTEMPTS
+
+
+@pytest.mark.usefixtures("canonical_rsids_mock", "get_variants_mock")
+class TestGetGenotypesMany:
+    @fixture(autouse=True)
+    def mock_files(self, monkeypatch, genotypes_dataset):
+        def get_parquet_paths_mock(file_ids):
+            return {
+                file_id: None if file_id == "not-ingested" else f"bucket/{file_id}"
+                for file_id in file_ids
+            }
+
+        def read_dataset_mock(base_path):
+            if base_path == "bucket/broken":
+                raise OSError("broken file")
+            return genotypes_dataset
+
+        monkeypatch.setattr(athena, "get_parquet_paths", get_parquet_paths_mock)
+        monkeypatch.setattr(athena, "read_dataset", read_dataset_mock)
+
+    def test_get_genotypes_many(self):
+        results = {
+            result.file_id: result
+            for result in athena.get_genotypes_many(
+                ["rs123"], ["f1", "not-ingested", "broken", "f2"], max_workers=2
+            )
+        }
+        assert set(results) == {"f1", "not-ingested", "broken", "f2"}
+        for file_id in ("f1", "f2"):
+            assert results[file_id].error is None
+            ((locus, (v1, v2)),) = results[file_id].genotypes.items()
+            assert locus == Locus("chr1", 1001, "rs123")
+            assert (v1.genotype, v2.genotype) == ("A", "G")
+        assert results["not-ingested"] == ("not-ingested", None, None)
+        assert isinstance(results["broken"].error, OSError)
+
+    def test_get_genotypes_many_invalid_sites(self):
+        results = list(athena.get_genotypes_many(["123"], ["f1", "not-ingested"]))
+        assert [result[:2] for result in results] == [
+            ("f1", None),
+            ("not-ingested", None),
+        ]
+        assert isinstance(results[0].error, ValueError)
+        assert results[1].error is None
+
+    def test_get_genotypes_many_raw(self):
+        (result,) = athena.get_genotypes_many(["rs123"], ["f1"], raw=True)
+        assert result.genotypes == {
+            Variant(chrom="chr1", pos=1001, ref="A", alt="G", rsid="rs123"): (0, 1)
+        }
+
+    def test_get_genotypes_many_timeout(self, monkeypatch, genotypes_dataset):
+        release = threading.Event()
+
+        def read_dataset_mock(base_path):
+            if base_path == "bucket/slow":
+                release.wait(5)
+            return genotypes_dataset
+
+        monkeypatch.setattr(athena, "read_dataset", read_dataset_mock)
+        try:
+            results = {
+                result.file_id: result
+                for result in athena.get_genotypes_many(
+                    ["rs123"], ["slow", "f1"], timeout=0.1
+                )
+            }
+        finally:
+            release.set()
+        assert results["f1"].error is None
+        assert isinstance(results["slow"].error, TimeoutError)
+
+
+def test_get_raw_gt_table(genotypes_dataset):
+    variants = [
+        Variant(chrom="chr1", pos=1002, ref="C", alt="G", rsid="rs999"),
+        Variant(chrom="chr1", pos=1001, ref="A", alt="G", rsid="rs123"),
+        Variant(chrom="chr2", pos=2002, ref="A", alt="G"),
+        Variant(chrom="chr2", pos=2002, ref="A", alt="T"),
+    ]
+    table = athena.get_raw_gt_table(variants, genotypes_dataset)
+    assert table.schema == athena.RAW_GT_SCHEMA
+    assert table.to_pylist() == [
+        {
+            "chrom": "chr1",
+            "pos": 1001,
+            "rsid": "rs123",
+            "ref": "A",
+            "alt": "G",
+            "gt1": 0,
+            "gt2": 1,
+        },
+        {
+            "chrom": "chr1",
+            "pos": 1002,
+            "rsid": "rs999",
+            "ref": "C",
+            "alt": "G",
+            "gt1": 0,
+            "gt2": 1,
+        },
+        {
+            "chrom": "chr2",
+            "pos": 2002,
+            "rsid": None,
+            "ref": "A",
+            "alt": "G",
+            "gt1": 0,
+            "gt2": 0,
+        },
+    ]
+    assert athena.get_raw_gt_table([], genotypes_dataset).num_rows == 0
+
+
+@pytest.mark.usefixtures("canonical_rsids_mock", "get_variants_mock")
+def test_get_genotypes_raw_table(monkeypatch, genotypes_dataset):
+    monkeypatch.setattr(athena, "get_parquet_path", lambda file_id: "bucket/f1")
+    monkeypatch.setattr(athena, "read_dataset", lambda base_path: genotypes_dataset)
+    table = athena.get_genotypes_raw_table(["rs123", "rs321"], "f1")
+    assert table.column("rsid").to_pylist() == ["rs123"]
+    assert athena.get_genotypes_raw_table(["rs321"], "f1").num_rows == 0
+    assert athena.get_genotypes_raw_table([], "f1").schema == athena.RAW_GT_SCHEMA
+
+
+def random_raw_gt(seed, n_loci):
+    "Return raw genotypes, as a dict and as a table, for random loci."
+    rng = random.Random(seed)
+    alleles = [
+        [("A", "G")],
+        [("A", "G"), ("A", "T")],
+        [("CAT", "TGC")],
+        [("AG", "A")],
+        [("AG", "A"), ("AGG", "A")],
+        [("A", "AGT"), ("A", "AGTGT")],
+        [("AGT", "A"), ("A", "AGTGT"), ("AGTGT", "A")],
+    ]
+    raw_gt = {}
+    for i in range(n_loci):
+        chrom, pos = rng.choice(["chr1", "chr2"]), rng.randrange(1000)
+        rsid = rng.choice([None, f"rs{i}"])
+        for ref, alt in rng.choice(alleles):
+            gt1, gt2 = (rng.choice([None, 0, 0, 1]) for _ in range(2))
+            raw_gt[Variant(chrom, pos, ref, alt, rsid)] = (gt1, gt2)
+    table = pyarrow.table(
+        {
+            "chrom": [variant.chrom for variant in raw_gt],
+            "pos": [variant.pos for variant in raw_gt],
+            "rsid": [variant.rsid for variant in raw_gt],
+            "ref": [variant.ref for variant in raw_gt],
+            "alt": [variant.alt for variant in raw_gt],
+            "gt1": [gt1 for gt1, _ in raw_gt.values()],
+            "gt2": [gt2 for _, gt2 in raw_gt.values()],
+        }
+    )
+    return raw_gt, table.cast(athena.RAW_GT_SCHEMA)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_format_raw_gt_table(seed):
+    raw_gt, table = random_raw_gt(seed, 200)
+
+    def with_genotypes(formatted):
+        return {
+            locus: tuple((v.ref, v.alt, v.rsid, v.genotype) for v in pair)
+            for locus, pair in formatted.items()
+        }
+
+    formatted_table = athena.format_raw_gt_table(table)
+    assert formatted_table.schema == athena.FORMATTED_GT_SCHEMA
+    assert with_genotypes(
+        athena.formatted_gt_table_to_dict(formatted_table)
+    ) == with_genotypes(athena.format_raw_gt(raw_gt))
+
+
+def test_format_raw_gt_table_empty():
+    assert athena.format_raw_gt_table(athena.RAW_GT_SCHEMA.empty_table()).num_rows == 0
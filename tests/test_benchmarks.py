@@ -0,0 +1,61 @@
+import pyarrow.dataset as ds
+from pytest import fixture
+from benchmarks import dataset, scenarios, stand_ins
+from variants_lib import Locus, athena
+
+FILE_ID = "00000000-0000-0000-0000-000000000001"
+
+
+@fixture
+def reference():
+    return dataset.generate_reference(200, seed=1, merged_fraction=0.5)
+
+
+@fixture
+def bucket(tmp_path, reference):
+    dataset.write_genome_file(str(tmp_path), FILE_ID, reference, 1000, n_parts=2)
+    with stand_ins.local_aws(
+        str(tmp_path),
+        dataset.build38_items(reference),
+        dataset.merged_rsids_items(reference),
+        stand_ins.etl_metadata_items([FILE_ID]),
+    ):
+        yield str(tmp_path)
+
+
+def test_genome_file(bucket, reference):
+    table = ds.dataset(dataset.parquet_path(bucket, FILE_ID)).to_table()
+    assert table.num_rows == 1000
+    assert set(athena.TABLE_COLUMNS) <= set(table.column_names)
+    assert any(len(site.alts) > 1 and len(site.ref) > 1 for site in reference)
+
+
+def test_get_genotypes(bucket, reference):
+    sites = reference[:50]
+    rsids = [site.merged_from or site.rsid for site in sites]
+    genotypes = athena.get_genotypes(rsids, FILE_ID)
+    assert set(genotypes) == {
+        Locus(site.chrom, site.pos, rsid) for site, rsid in zip(sites, rsids)
+    }
+
+
+def test_run_scenario(bucket, reference):
+    result = scenarios.run_scenario(
+        scenarios.Scenario(panel_size=5, file_rows=1000, concurrency=2),
+        reference,
+        [FILE_ID],
+        n_requests=4,
+    )
+    assert result["requests"] == 4
+    assert 0 < result["p50_ms"] <= result["p99_ms"]
+    assert result["throughput_rps"] > 0
+
+
+def test_run_benchmarks():
+    results = scenarios.run_benchmarks(
+        [5], [200], [1, 2], n_requests=2, reference_size=200, n_files=1
+    )
+    assert [result["concurrency"] for result in results["scenarios"]] == [1, 2]
+    for result in results["scenarios"]:
+        assert result["peak_rss_bytes"] > 0
+        assert result["arrow_peak_bytes"] > 0
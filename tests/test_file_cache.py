@@ -0,0 +1,170 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import shutil
+from pytest import fixture
+import pyarrow
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from variants_lib import athena, file_cache
+
+BASE_PATH = "bucket/user_genome_files/parquets/file_id=1"
+
+
+class LocalS3Client:
+    "Serve the bucket from a local directory, counting the calls."
+
+    def __init__(self, root):
+        self.root = root
+        self.lists = 0
+        self.downloads = 0
+
+    def get_paginator(self, operation):
+        assert operation == "list_objects_v2"
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        self.lists += 1
+        contents = []
+        for directory, _, files in os.walk(os.path.join(self.root, Bucket)):
+            for name in files:
+                path = os.path.join(directory, name)
+                key = os.path.relpath(path, os.path.join(self.root, Bucket))
+                if key.startswith(Prefix):
+                    with open(path, "rb") as obj:
+                        etag = hashlib.md5(obj.read()).hexdigest()
+                    contents.append(
+                        {"Key": key, "ETag": etag, "Size": os.path.getsize(path)}
+                    )
+        return [{"Contents": contents}]
+
+    def download_file(self, Bucket, Key, Filename):
+        self.downloads += 1
+        shutil.copyfile(os.path.join(self.root, Bucket, Key), Filename)
+
+
+def write_file(root, base_path, n_rows, name="part-0.parquet"):
+    table = pyarrow.table(
+        {
+            "chrom": ["chr1"] * n_rows,
+            "pos": list(range(n_rows)),
+            "rsid": [None] * n_rows,
+            "ref": ["A"] * n_rows,
+            "alt": ["G"] * n_rows,
+            "gt1": [0] * n_rows,
+            "gt2": [1] * n_rows,
+        }
+    )
+    os.makedirs(os.path.join(root, base_path), exist_ok=True)
+    pq.write_table(table, os.path.join(root, base_path, name))
+
+
+@fixture
+def s3(tmp_path):
+    write_file(tmp_path / "s3", BASE_PATH, 10)
+    return LocalS3Client(str(tmp_path / "s3"))
+
+
+def make_cache(tmp_path, s3, **kwargs):
+    return file_cache.FileCache(
+        str(tmp_path / "cache"), s3_client=s3, **{"max_bytes": 1 << 20, **kwargs}
+    )
+
+
+def test_read_through(tmp_path, s3):
+    cache = make_cache(tmp_path, s3)
+    local_dir = cache.get(BASE_PATH)
+    assert os.listdir(local_dir) == ["part-0.parquet"]
+    assert cache.get(BASE_PATH) == local_dir
+    assert (s3.lists, s3.downloads) == (1, 1)
+
+
+def test_etag_validation(tmp_path, s3):
+    cache = make_cache(tmp_path, s3, validate_ttl=0)
+    cache.get(BASE_PATH)
+    cache.get(BASE_PATH)
+    assert (s3.lists, s3.downloads) == (2, 1)
+    write_file(s3.root, BASE_PATH, 20)
+    local_dir = cache.get(BASE_PATH)
+    assert (s3.lists, s3.downloads) == (3, 2)
+    assert pq.read_table(os.path.join(local_dir, "part-0.parquet")).num_rows == 20
+
+
+def s3_objects(s3, base_path):
+    bucket, prefix = file_cache.split_path(base_path)
+    return [
+        (obj["Key"], obj["Size"])
+        for obj in s3.paginate(Bucket=bucket, Prefix=prefix)[0]["Contents"]
+    ]
+
+
+def test_lru_eviction(tmp_path, s3):
+    base_paths = [f"bucket/parquets/file_id={i}" for i in range(3)]
+    for base_path in base_paths:
+        write_file(s3.root, base_path, 1000)
+    file_size = sum(size for _, size in s3_objects(s3, base_paths[0]))
+    cache = make_cache(tmp_path, s3, max_bytes=2 * file_size, eviction_grace=0)
+    version_dirs = [
+        os.path.dirname(cache.get(base_path)) for base_path in base_paths[:2]
+    ]
+    os.utime(version_dirs[0], (0, 0))
+    os.utime(version_dirs[1], (1, 1))
+    cache.get(base_paths[2])
+    assert not os.path.exists(cache.entry_dir(base_paths[0]))
+    assert os.path.exists(cache.entry_dir(base_paths[1]))
+    assert cache.size() == 2 * file_size
+
+
+def test_replaced_version_stays_readable(tmp_path, s3):
+    cache = make_cache(tmp_path, s3, validate_ttl=0, eviction_grace=3600)
+    old_dir = cache.get(BASE_PATH)
+    write_file(s3.root, BASE_PATH, 20)
+    new_dir = cache.get(BASE_PATH)
+    assert new_dir != old_dir
+    assert ds.dataset(old_dir).to_table().num_rows == 10
+    assert ds.dataset(new_dir).to_table().num_rows == 20
+    # the replaced version is evicted once it is no longer used
+    cache.eviction_grace = 0
+    cache.evict()
+    assert not os.path.exists(old_dir)
+    assert ds.dataset(cache.get(BASE_PATH)).to_table().num_rows == 20
+
+
+def test_too_large(tmp_path, s3):
+    cache = make_cache(tmp_path, s3, max_bytes=10)
+    assert cache.get(BASE_PATH) is None
+    assert cache.size() == 0
+
+
+def test_concurrent_gets(tmp_path, s3):
+    caches = [make_cache(tmp_path, s3) for _ in range(8)]
+    with ThreadPoolExecutor(8) as pool:
+        local_dirs = set(pool.map(lambda cache: cache.get(BASE_PATH), caches))
+    (local_dir,) = local_dirs
+    assert os.listdir(local_dir) == ["part-0.parquet"]
+    assert os.listdir(os.path.join(caches[0].cache_dir, "tmp")) == []
+
+
+def test_concurrent_gets_and_reads(tmp_path, s3):
+    def get_and_read(cache):
+        # the dataset lists its files lazily, after the other installations
+        dataset = ds.dataset(cache.get(BASE_PATH))
+        return dataset.to_table().num_rows
+
+    for i in range(20):
+        caches = [make_cache(tmp_path / str(i), s3) for _ in range(8)]
+        with ThreadPoolExecutor(8) as pool:
+            assert list(pool.map(get_and_read, caches)) == [10] * 8
+
+
+def test_read_dataset(tmp_path, s3, monkeypatch):
+    cache = make_cache(tmp_path, s3)
+    monkeypatch.setattr(file_cache, "get_file_cache", lambda: cache)
+    monkeypatch.setattr(athena, "get_s3_filesystem", lambda: None)
+    dataset = athena.read_dataset(BASE_PATH)
+    assert dataset.to_table().num_rows == 10
+    # only the files on S3 go through the cache
+    local_path = os.path.join(s3.root, BASE_PATH)
+    assert athena.read_dataset(local_path, "local").to_table().num_rows == 10
+    assert s3.downloads == 1
+    athena.clear_dataset_cache()
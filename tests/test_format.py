@@ -1,9 +1,13 @@
+import itertools
 import pytest
+import pyarrow
 from variants_lib.format_variants import (
     detect_variation_type,
+    detect_variation_types_from_offsets,
     VariationType,
     factor_sequence,
     describe_alt,
+    describe_alts,
     decode_indel,
 )
 
@@ -85,6 +89,21 @@ def test_factor_sequence(sequence, expected):
     assert infix * count == sequence
 
 
+def test_factor_sequence_matches_brute_force():
+    def brute_force(sequence):
+        for length in range(1, len(sequence) // 2 + 1):
+            i = len(sequence) // length
+            if sequence == sequence[:length] * i:
+                return (sequence[:length], i)
+        return (sequence, 1)
+
+    for sequence in itertools.chain.from_iterable(
+        map("".join, itertools.product("AB", repeat=n)) for n in range(1, 11)
+    ):
+        assert factor_sequence(sequence) == brute_force(sequence)
+    assert factor_sequence("CAG" * 10_000) == ("CAG", 10_000)
+
+
 INSDEL_EXAMPLES = [
     ("A", "AA", "INS(A)_1"),
     ("A", "ABC", "INS(BC)_1"),
@@ -100,6 +119,14 @@ def test_describe_alt(ref, alt, expected):
     assert describe_alt(ref, alt) == expected
 
 
+def test_describe_alts():
+    refs = [ref for ref, _, _ in INSDEL_EXAMPLES] * 2 + ["A", None]
+    alts = [alt for _, alt, _ in INSDEL_EXAMPLES] * 2 + ["G", "AA"]
+    assert describe_alts(pyarrow.array(refs), pyarrow.array(alts)).to_pylist() == [
+        expected for _, _, expected in INSDEL_EXAMPLES
+    ] * 2 + ["G", None]
+
+
 INDEL_DECODE_EXAMPLES = [
     (
         [
@@ -209,3 +236,22 @@ INSERTION_DECODE_EXAMPLES = [
 @pytest.mark.parametrize("rows,expected", INSERTION_DECODE_EXAMPLES)
 def test_decode_insertion(rows, expected):
     assert decode_indel(rows) == expected
+
+
+def test_detect_variation_types_from_offsets():
+    loci = (
+        [[("A", "G")], [("A", "G"), ("A", "T")], [("CAT", "TGC")]]
+        + [[alleles] for alleles in DELETION_EXAMPLES_MONOALLELIC]
+        + DELETION_EXAMPLES_MULTIALLELIC
+        + [[alleles] for alleles in INSERTION_EXAMPLES_MONOALLELIC]
+        + INSERTION_EXAMPLES_MULTIALLELIC
+        + INDEL_EXAMPLES
+    )
+    offsets = [0]
+    for alleles in loci:
+        offsets.append(offsets[-1] + len(alleles))
+    refs = pyarrow.array([ref for alleles in loci for ref, _ in alleles])
+    alts = pyarrow.array([alt for alleles in loci for _, alt in alleles])
+    assert detect_variation_types_from_offsets(refs, alts, offsets).to_pylist() == [
+        detect_variation_type(alleles).name for alleles in loci
+    ]
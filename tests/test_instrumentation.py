@@ -0,0 +1,77 @@
+from collections import defaultdict
+from pytest import fixture
+from benchmarks import dataset, stand_ins
+from variants_lib import athena, instrumentation
+
+FILE_ID = "00000000-0000-0000-0000-000000000001"
+
+
+@fixture
+def measurements():
+    recorded = defaultdict(list)
+    instrumentation.set_sink(
+        instrumentation.CallbackSink(
+            lambda kind, name, value: recorded[(kind, name)].append(value)
+        )
+    )
+    yield recorded
+    instrumentation.set_sink(None)
+
+
+def test_get_genotypes_stages(tmp_path, measurements):
+    reference = dataset.generate_reference(100, seed=2)
+    dataset.write_genome_file(str(tmp_path), FILE_ID, reference, 500)
+    with stand_ins.local_aws(
+        str(tmp_path),
+        dataset.build38_items(reference),
+        dataset.merged_rsids_items(reference),
+        stand_ins.etl_metadata_items([FILE_ID]),
+    ):
+        genotypes = athena.get_genotypes(
+            [site.rsid for site in reference[:20]], FILE_ID
+        )
+    assert {name for kind, name in measurements if kind == "timing"} == {
+        "sts",
+        "canonicalize",
+        "build38",
+        "etl_metadata",
+        "dataset_discovery",
+        "scan",
+        "filter",
+        "format",
+    }
+    assert measurements[("count", "rsids")] == [20]
+    # merged-rsids and build38 each fit in a batch
+    assert measurements[("count", "ddb_batches")] == [1, 1]
+    assert measurements[("count", "rows_scanned")][0] >= 20
+    assert measurements[("count", "rows_matched")] == [
+        sum(len(site.variants()) for site in reference[:20])
+    ]
+    assert measurements[("count", "logical_variants")] == [len(genotypes)] == [20]
+
+
+def test_statsd_sink():
+    class Client:
+        def __init__(self):
+            self.calls = []
+
+        def timing(self, name, value):
+            self.calls.append(("timing", name, value))
+
+        def incr(self, name, value):
+            self.calls.append(("incr", name, value))
+
+    client = Client()
+    sink = instrumentation.StatsdSink(client, prefix="genotypes")
+    sink.timing("scan", 0.5)
+    sink.count("rows_scanned", 3)
+    assert client.calls == [
+        ("timing", "genotypes.scan", 500),
+        ("incr", "genotypes.rows_scanned", 3),
+    ]
+
+
+def test_no_sink():
+    assert instrumentation.get_sink() is None
+    with instrumentation.stage("scan"):
+        instrumentation.count("rows_scanned", 1)
@@ -28,3 +28,13 @@ class TestCanonicalRsid:
             "rs456": "rs456",
             "rs789": "rs789",
         }
+
+    def test_canonical_rsids_are_cached(self, monkeypatch):
+        merges.canonical_rsids(["rs123", "rs789"])
+        monkeypatch.setattr(merges, "get_ddb_client", None)
+        assert merges.canonical_rsids(["rs789", "rs123"]) == {
+            "rs789": "rs789",
+            "rs123": "rs456",
+        }
+        stats = merges.canonical_rsids_cache.stats()
+        assert (stats["hits"], stats["entries"]) == (2, 2)
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta, timezone
+import os
+from pytest import fixture
+from variants_lib import merges, merges_snapshot
+
+ITEMS = [
+    {"rsid": {"S": "rs123"}, "merged_into": {"S": "rs456"}},
+    {"rsid": {"S": "rs321"}},
+    {"rsid": {"S": "rs77"}, "merged_into": {"S": "rs78"}},
+]
+
+
+@fixture
+def snapshot_path(tmp_path):
+    path = str(tmp_path / "merged-rsids.arrow")
+    assert merges_snapshot.write_snapshot(ITEMS, path) == 2
+    return path
+
+
+def test_canonical_rsids(snapshot_path):
+    snapshot = merges_snapshot.MergedRsidsSnapshot(snapshot_path)
+    assert len(snapshot) == 2
+    assert snapshot.age() < 60
+    assert snapshot.canonical_rsids(
+        ["rs123", "rs321", "rs77", "rs1", "foo", "rs0123"]
+    ) == {
+        "rs123": "rs456",
+        "rs321": "rs321",
+        "rs77": "rs78",
+        "rs1": "rs1",
+        "foo": "foo",
+        # not found by the table either
+        "rs0123": "rs0123",
+    }
+
+
+def test_snapshot_is_reloaded_when_replaced(snapshot_path):
+    snapshot = merges_snapshot.open_merged_rsids_snapshot(snapshot_path)
+    assert merges_snapshot.open_merged_rsids_snapshot(snapshot_path) is snapshot
+    merges_snapshot.write_snapshot(ITEMS[:1], snapshot_path)
+    stat = os.stat(snapshot_path)
+    os.utime(snapshot_path, (stat.st_atime, stat.st_mtime + 1))
+    assert len(merges_snapshot.open_merged_rsids_snapshot(snapshot_path)) == 1
+
+
+class TestMergesUsesSnapshot:
+    @fixture(autouse=True)
+    def no_table(self, monkeypatch):
+        monkeypatch.setattr(merges, "get_ddb_client", None)
+
+    def test_fresh_snapshot(self, snapshot_path, monkeypatch):
+        monkeypatch.setattr(merges, "SNAPSHOT_PATH", snapshot_path)
+        assert merges.canonical_rsids(["rs123", "rs1"]) == {
+            "rs123": "rs456",
+            "rs1": "rs1",
+        }
+
+    def test_stale_snapshot(self, tmp_path, monkeypatch):
+        path = str(tmp_path / "stale.arrow")
+        exported_at = datetime.now(timezone.utc) - timedelta(days=30)
+        merges_snapshot.write_snapshot(ITEMS, path, exported_at=exported_at)
+        monkeypatch.setattr(merges, "SNAPSHOT_PATH", path)
+        assert merges._get_snapshot() is None  # pylint: disable=protected-access
@@ -0,0 +1,129 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import gzip
+import json
+import multiprocessing
+import os
+import sys
+from pytest import fixture
+import pytest
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import parse_panel
+from variants_lib.format_variants import detect_variation_type
+
+FILES = [
+    [
+        ("chr2", 300, "A", "G"),
+        ("chr1", 100, "A", "G"),
+        ("chrM", 5, "A", "G"),  # not in CHROM_LIST
+        ("chr1", 200, "AGT", "A"),
+    ],
+    [
+        ("chr1", 100, "A", "T"),
+        ("chrX", 50, "C", "CTT"),
+        ("chr1", 150, "G", "C"),
+        ("chr1", 200, "A", "AGT"),
+    ],
+    [
+        ("chr2", 300, "AG", "A"),
+        ("chr1", 120, "T", "C"),
+    ],
+]
+
+
+@fixture
+def data_dir(tmp_path, monkeypatch):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    for i, rows in enumerate(FILES):
+        with gzip.open(data_dir / f"part-{i}.json.gz", "wt") as data:
+            for chrom, pos, ref, alt in rows:
+                data.write(
+                    json.dumps({"chrom": chrom, "pos": pos, "ref": ref, "alt": alt})
+                    + "\n"
+                )
+    monkeypatch.setattr(parse_panel, "DATA_DIR", str(data_dir))
+    # the workers inherit the patched DATA_DIR
+    monkeypatch.setattr(
+        parse_panel,
+        "ProcessPoolExecutor",
+        partial(ProcessPoolExecutor, mp_context=multiprocessing.get_context("fork")),
+    )
+    return data_dir
+
+
+def baseline_output(files):
+    "The output of the original script: one chromosome after the other."
+    lines = []
+    for chrom in parse_panel.CHROM_LIST:
+        data = parse_panel.load_chrom_data(files, chrom)
+        for locus in data:
+            lines.append(
+                json.dumps(
+                    {
+                        "chrom": chrom,
+                        "pos": locus,
+                        "type": detect_variation_type(data[locus]).name,
+                        "alleles": data[locus],
+                    }
+                )
+                + "\n"
+            )
+    return "".join(lines)
+
+
+def run(tmp_path, monkeypatch, name, args):
+    output_dir = tmp_path / name
+    output_dir.mkdir()
+    monkeypatch.chdir(output_dir)
+    monkeypatch.setattr(sys, "argv", ["parse_panel.py", *args])
+    parse_panel.main()
+    return output_dir
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        [],
+        ["--workers", "4", "--buffer-rows", "2"],
+        ["--multi-pass"],
+        ["--multi-pass", "--workers", "3"],
+    ],
+)
+def test_json_output(tmp_path, monkeypatch, data_dir, args):
+    expected = baseline_output(os.listdir(data_dir))
+    output_dir = run(tmp_path, monkeypatch, "output", args)
+    with gzip.open(output_dir / "output.json.gz", "rt") as output:
+        assert output.read() == expected
+
+
+def test_parquet_output(tmp_path, monkeypatch, data_dir):
+    files = os.listdir(data_dir)
+    output_dir = run(
+        tmp_path, monkeypatch, "output", ["--format", "parquet", "--workers", "2"]
+    )
+    dataset_dir = output_dir / "output.parquet"
+    assert sorted(p.name for p in dataset_dir.iterdir()) == sorted(
+        f"chrom={chrom}" for chrom in parse_panel.CHROM_LIST
+    )
+    schema = pq.read_schema(dataset_dir / "chrom=chr1" / "part-0.parquet")
+    assert schema.equals(parse_panel.PARQUET_SCHEMA)
+    table = ds.dataset(dataset_dir, partitioning="hive").to_table()
+    rows = sorted(
+        (
+            row["chrom"],
+            row["pos"],
+            row["type"],
+            [tuple(a.values()) for a in row["alleles"]],
+        )
+        for row in table.to_pylist()
+    )
+    expected = sorted(
+        (line["chrom"], line["pos"], line["type"], [tuple(a) for a in line["alleles"]])
+        for line in map(json.loads, baseline_output(files).splitlines())
+    )
+    assert rows == expected
+    # sorted by position within each partition
+    chr1 = pq.read_table(dataset_dir / "chrom=chr1" / "part-0.parquet")
+    assert chr1.column("pos").to_pylist() == [100, 120, 150, 200]
@@ -0,0 +1,242 @@
+import os
+from pytest import fixture
+import pytest
+import pyarrow
+from variants_lib import reference_index, Locus, Variant
+from variants_lib import variants as variants_module
+
+ITEMS = [
+    {
+        "rsid": {"S": "rs456"},
+        "chrom": {"S": "chr2"},
+        "pos": {"N": "15000"},
+        "ref": {"S": "AGTGT"},
+        "alt": {"L": [{"S": "A"}, {"S": "AGT"}, {"S": "AGTGTGT"}]},
+    },
+    {
+        "rsid": {"S": "rs123"},
+        "chrom": {"S": "chr1"},
+        "pos": {"N": "10000"},
+        "ref": {"S": "A"},
+        "alt": {"L": [{"S": "G"}]},
+    },
+    {
+        "rsid": {"S": "rs9"},
+        "chrom": {"S": "chr1"},
+        "pos": {"N": "500"},
+        "ref": {"S": "C"},
+        "alt": {"L": [{"S": "T"}]},
+    },
+]
+
+
+class ScanDdbClient:
+    def __init__(self, items):
+        self.items = items
+
+    def scan(self, TableName, Segment, TotalSegments, ExclusiveStartKey=None):
+        items = self.items[Segment::TotalSegments]
+        start = ExclusiveStartKey["index"] if ExclusiveStartKey else 0
+        resp = {"Items": items[start : start + 1]}
+        if start + 1 < len(items):
+            resp["LastEvaluatedKey"] = {"index": start + 1}
+        return resp
+
+
+@fixture
+def index_path(tmp_path):
+    path = str(tmp_path / "build38.arrow")
+    assert reference_index.write_index(ITEMS, path) == 3
+    return path
+
+
+def test_rsid_number():
+    assert reference_index.rsid_number("rs123") == 123
+    assert reference_index.rsid_number("123") is None
+    assert reference_index.rsid_number("rsX") is None
+    assert reference_index.rsid_number("rs0123") is None
+    assert reference_index.rsid_number("rs١٢٣") is None  # Arabic-Indic digits
+    assert reference_index.rsid_number("rs0") == 0
+
+
+def test_non_canonical_rsids(index_path):
+    index = reference_index.Build38Index(index_path)
+    assert index.get_loci(["rs0123", "rs9"]) == {"rs9": Locus("chr1", 500)}
+
+
+def test_get_variants(index_path):
+    index = reference_index.Build38Index(index_path)
+    assert len(index) == 3
+    assert index.get_variants(["rs123", "rs456", "rs1", "foo"]) == {
+        "rs123": [Variant(chrom="chr1", pos=10000, ref="A", alt="G")],
+        "rs456": [
+            Variant(chrom="chr2", pos=15000, ref="AGTGT", alt="A"),
+            Variant(chrom="chr2", pos=15000, ref="AGT", alt="A"),
+            Variant(chrom="chr2", pos=15000, ref="A", alt="AGT"),
+        ],
+    }
+    assert index.get_variants(["rs456"], normalized=False)["rs456"][1] == Variant(
+        chrom="chr2", pos=15000, ref="AGTGT", alt="AGT"
+    )
+
+
+def test_get_loci(index_path):
+    index = reference_index.Build38Index(index_path)
+    assert index.get_loci(["rs9", "rs10"]) == {"rs9": Locus(chrom="chr1", pos=500)}
+
+
+def test_empty_index(tmp_path):
+    path = str(tmp_path / "empty.arrow")
+    reference_index.write_index([], path)
+    assert reference_index.Build38Index(path).get_variants(["rs1"]) == {}
+
+
+def test_write_index_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(reference_index, "WRITE_BATCH_SIZE", 1)
+    path = str(tmp_path / "build38.arrow")
+    items = [{"rsid": {"S": "foo"}}] + ITEMS
+    assert reference_index.write_index(items, path) == 3
+    index = reference_index.Build38Index(path)
+    assert index.get_loci(["rs9", "rs456"]) == {
+        "rs9": Locus("chr1", 500),
+        "rs456": Locus("chr2", 15000),
+    }
+    assert [v.rsid for v in index.get_variants_in_range("chr1", 0, 20000)] == [
+        "rs9",
+        "rs123",
+    ]
+
+
+def test_many_contigs(tmp_path):
+    items = [
+        {
+            "rsid": {"S": f"rs{i}"},
+            "chrom": {"S": f"chrUn_{i}"},
+            "pos": {"N": "100"},
+            "ref": {"S": "A"},
+            "alt": {"L": [{"S": "G"}]},
+        }
+        for i in range(1000)
+    ]
+    path = str(tmp_path / "build38.arrow")
+    assert reference_index.write_index(items, path) == 1000
+    index = reference_index.Build38Index(path)
+    assert index.get_loci(["rs999"]) == {"rs999": Locus("chrUn_999", 100)}
+    assert index.get_variants_in_range("chrUn_999", 0, 200) == [
+        Variant("chrUn_999", 100, "A", "G", rsid="rs999")
+    ]
+
+
+def test_export_build38(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        reference_index, "get_ddb_client", lambda role: ScanDdbClient(ITEMS)
+    )
+    path = str(tmp_path / "build38.arrow")
+    assert reference_index.export_build38(path, total_segments=2) == 3
+    assert reference_index.Build38Index(path).get_loci(["rs456"]) == {
+        "rs456": Locus(chrom="chr2", pos=15000)
+    }
+
+
+def test_index_is_reloaded_when_replaced(index_path):
+    index = reference_index.open_build38_index(index_path)
+    assert reference_index.open_build38_index(index_path) is index
+    reference_index.write_index(ITEMS[:1], index_path)
+    stat = os.stat(index_path)
+    os.utime(index_path, (stat.st_atime, stat.st_mtime + 1))
+    assert len(reference_index.open_build38_index(index_path)) == 1
+
+
+def test_variants_module_uses_index(index_path, monkeypatch):
+    monkeypatch.setattr(variants_module, "INDEX_PATH", index_path)
+    monkeypatch.setattr(variants_module, "get_ddb_client", None)
+    assert variants_module.get_loci(["rs123"]) == {"rs123": Locus("chr1", 10000)}
+
+
+class TestLocusLookups:
+    def test_get_variants_at_loci(self, index_path):
+        index = reference_index.Build38Index(index_path)
+        assert index.get_variants_at_loci(
+            [Locus("chr1", 500), Locus("chr2", 15000), Locus("chr1", 501)],
+            normalized=False,
+        ) == {
+            Locus("chr1", 500): [Variant("chr1", 500, "C", "T", rsid="rs9")],
+            Locus("chr2", 15000): [
+                Variant("chr2", 15000, "AGTGT", "A", rsid="rs456"),
+                Variant("chr2", 15000, "AGTGT", "AGT", rsid="rs456"),
+                Variant("chr2", 15000, "AGTGT", "AGTGTGT", rsid="rs456"),
+            ],
+        }
+
+    def test_get_variants_in_range(self, index_path):
+        index = reference_index.Build38Index(index_path)
+        assert index.get_variants_in_range("chr1", 0, 20000) == [
+            Variant("chr1", 500, "C", "T", rsid="rs9"),
+            Variant("chr1", 10000, "A", "G", rsid="rs123"),
+        ]
+        assert index.get_variants_in_range("chr1", 501, 10000) == []
+        assert index.get_variants_in_range("chrX", 0, 20000) == []
+
+    def test_stored_position_order(self, index_path):
+        index = reference_index.Build38Index(index_path)
+        order = index.table.column("position_row")
+        by_position = index.table.take(order).select(["chrom", "pos"]).to_pylist()
+        # the chromosomes come in the order of their dictionary
+        assert [(row["chrom"], row["pos"]) for row in by_position] == [
+            ("chr2", 15000),
+            ("chr1", 500),
+            ("chr1", 10000),
+        ]
+
+    def test_positional_index_is_memory_mapped(self, tmp_path):
+        items = [
+            {
+                "rsid": {"S": f"rs{i}"},
+                "chrom": {"S": f"chr{i % 3 + 1}"},
+                "pos": {"N": str(100000 - i)},
+                "ref": {"S": "A"},
+                "alt": {"L": [{"S": "G"}]},
+            }
+            for i in range(30000)
+        ]
+        path = str(tmp_path / "build38.arrow")
+        reference_index.write_index(items, path)
+        index = reference_index.Build38Index(path)
+        allocated = pyarrow.total_allocated_bytes()
+        assert [v.rsid for v in index.get_variants_in_range("chr2", 0, 70006)] == [
+            "rs29998",
+            "rs29995",
+        ]
+        # no copy of the positions (8 bytes per row)
+        assert pyarrow.total_allocated_bytes() - allocated < 30000 * 8
+
+    def test_index_without_positional_index(self, index_path, tmp_path):
+        table = reference_index.Build38Index(index_path).table
+        # as written before the positional index was stored
+        table = table.drop(["position_row", "position_pos"]).replace_schema_metadata()
+        path = str(tmp_path / "old.arrow")
+        with pyarrow.OSFile(path, "wb") as sink:
+            with pyarrow.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        index = reference_index.Build38Index(path)
+        assert [v.rsid for v in index.get_variants_in_range("chr1", 0, 20000)] == [
+            "rs9",
+            "rs123",
+        ]
+
+    def test_empty_index(self, tmp_path):
+        path = str(tmp_path / "empty.arrow")
+        reference_index.write_index([], path)
+        index = reference_index.Build38Index(path)
+        assert index.get_variants_in_range("chr1", 0, 20000) == []
+
+    def test_variants_module(self, index_path, monkeypatch):
+        monkeypatch.setattr(variants_module, "INDEX_PATH", index_path)
+        assert variants_module.get_variants_in_range("chr1", 10000, 10001) == [
+            Variant("chr1", 10000, "A", "G", rsid="rs123")
+        ]
+
+    def test_variants_module_without_index(self, monkeypatch):
+        monkeypatch.setattr(variants_module, "INDEX_PATH", None)
+        with pytest.raises(RuntimeError):
+            variants_module.get_variants_at_loci([Locus("chr1", 500)])
@@ -0,0 +1,174 @@
+from datetime import datetime, timedelta, timezone
+from pytest import fixture
+import pytest
+from variants_lib import utils
+from .utils import MockDdbClient
+
+
+@fixture
+def assume_role_mock(monkeypatch):
+    calls = []
+    lifetime = {"value": timedelta(hours=1)}
+
+    def mock(role):
+        calls.append(role)
+        return object(), datetime.now(timezone.utc) + lifetime["value"]
+
+    utils.clear_ddb_clients()
+    monkeypatch.setattr(utils, "_assume_role_ddb_client", mock)
+    yield calls, lifetime
+    utils.clear_ddb_clients()
+
+
+def test_client_is_cached_per_role(assume_role_mock):
+    calls, _ = assume_role_mock
+    client = utils.get_ddb_client("build38")
+    assert utils.get_ddb_client("build38") is client
+    assert utils.get_ddb_client("merged-rsids") is not client
+    assert calls == ["build38", "merged-rsids"]
+
+
+def test_client_is_refreshed_before_expiration(assume_role_mock):
+    calls, lifetime = assume_role_mock
+    lifetime["value"] = utils.CREDENTIALS_REFRESH_MARGIN / 2
+    client = utils.get_ddb_client("build38")
+    assert utils.get_ddb_client("build38") is not client
+    assert calls == ["build38", "build38"]
+
+
+class TestLRUCache:
+    def test_evicts_least_recently_used(self):
+        cache = utils.LRUCache(max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert cache.get("a") == 1
+        cache.set("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+        assert len(cache) == 2
+
+    def test_ttl(self, monkeypatch):
+        now = {"value": 100.0}
+        monkeypatch.setattr(utils.time, "monotonic", lambda: now["value"])
+        cache = utils.LRUCache(max_size=2, ttl=10)
+        cache.set("a", 1)
+        now["value"] += 5
+        assert cache.get("a") == 1
+        now["value"] += 10
+        assert cache.get("a", "missing") == "missing"
+        assert len(cache) == 0
+
+    def test_max_bytes(self):
+        cache = utils.LRUCache(
+            max_size=10, max_bytes=10, sizeof=lambda key, value: len(value)
+        )
+        cache.set("a", "xxxx")
+        cache.set("b", "xxxx")
+        cache.set("a", "xxx")
+        cache.set("c", "xxxx")
+        assert cache.get("b") is None
+        assert cache.get("a") == "xxx"
+        assert cache.stats() == {
+            "entries": 2,
+            "bytes": 7,
+            "hits": 1,
+            "misses": 1,
+            "evictions": 1,
+            "expirations": 0,
+        }
+
+
+class ThrottledDdbClient(MockDdbClient):
+    "Only process the first key of each request, like a heavily throttled table."
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.requests = []
+
+    def batch_get_item(self, RequestItems):
+        keys = RequestItems[self.table_name]["Keys"]
+        self.requests.append(keys)
+        resp = super().batch_get_item({self.table_name: {"Keys": keys[:1]}})
+        if keys[1:]:
+            resp["UnprocessedKeys"] = {self.table_name: {"Keys": keys[1:]}}
+        return resp
+
+
+class TestBatchGetItems:
+    @fixture(autouse=True)
+    def no_sleep(self, monkeypatch):
+        monkeypatch.setattr(utils.time, "sleep", lambda delay: None)
+
+    def make_client(self, n_items):
+        return ThrottledDdbClient(
+            table_name="table",
+            items=[{"rsid": {"S": f"rs{i}"}} for i in range(n_items)],
+            key_name="rsid",
+        )
+
+    def test_slices_and_deduplication(self):
+        client = MockDdbClient(
+            table_name="table",
+            items=[{"rsid": {"S": f"rs{i}"}} for i in range(250)],
+            key_name="rsid",
+        )
+        keys = [f"rs{i}" for i in range(300)] * 2
+        items = utils.batch_get_items(client, "table", "rsid", keys)
+        assert sorted(item["rsid"]["S"] for item in items) == sorted(
+            f"rs{i}" for i in range(250)
+        )
+
+    def test_unprocessed_keys_are_retried(self):
+        client = self.make_client(3)
+        items = utils.batch_get_items(client, "table", "rsid", ["rs0", "rs1", "rs2"])
+        assert [item["rsid"]["S"] for item in items] == ["rs0", "rs1", "rs2"]
+        assert len(client.requests) == 3
+
+    def test_gives_up_after_max_attempts(self):
+        client = self.make_client(3)
+        with pytest.raises(RuntimeError):
+            utils.batch_get_items(
+                client, "table", "rsid", ["rs0", "rs1", "rs2"], max_attempts=2
+            )
+
+
+class PagedScanDdbClient:
+    "Serve `n_pages` pages of 2 items per segment, failing on the `fail` segment."
+
+    def __init__(self, n_pages, fail=None):
+        self.n_pages = n_pages
+        self.fail = fail
+        self.scans = 0
+
+    def scan(self, TableName, Segment, TotalSegments, ExclusiveStartKey=None):
+        self.scans += 1
+        if Segment == self.fail:
+            raise RuntimeError("scan failed")
+        page = ExclusiveStartKey["page"] if ExclusiveStartKey else 0
+        items = [{"rsid": {"S": f"rs{Segment}-{page}-{i}"}} for i in range(2)]
+        resp = {"Items": items}
+        if page + 1 < self.n_pages:
+            resp["LastEvaluatedKey"] = {"page": page + 1}
+        return resp
+
+
+class TestScanTable:
+    def test_pages(self):
+        pages = list(utils.scan_pages(PagedScanDdbClient(3), "table", 4))
+        assert len(pages) == 12
+        assert all(len(page) == 2 for page in pages)
+        items = list(utils.scan_table(PagedScanDdbClient(3), "table", 4))
+        assert len({item["rsid"]["S"] for item in items}) == 24
+
+    def test_errors_are_raised(self):
+        with pytest.raises(RuntimeError):
+            list(utils.scan_table(PagedScanDdbClient(3, fail=1), "table", 4))
+
+    def test_stops_when_closed(self):
+        client = PagedScanDdbClient(1000)
+        pages = utils.scan_pages(client, "table", 2)
+        next(pages)
+        pages.close()
+        # the buffer is bounded and the segments stop once the consumer is gone
+        assert client.scans < 100
@@ -1,6 +1,13 @@
+import pickle
 from pytest import fixture
 from unittest.mock import Mock
-from variants_lib.variants import get_loci, get_variants, normalize_variant
+import pyarrow
+from variants_lib.variants import (
+    get_loci,
+    get_variants,
+    normalize_variant,
+    normalize_variants,
+)
 from variants_lib import variants as variants_module
 from variants_lib import Locus, Variant
 from .utils import MockDdbClient
@@ -15,6 +22,44 @@ def test_variants_equality():
 def test_variant_id():
     v1 = Variant("chr1", 1000, "A", "T", "rs123")
     assert v1.id == "1_1000_A_T"
+    assert v1.id is v1.id
+
+
+def test_variant_key_and_hash():
+    v1 = Variant("chr1", 1000, "A", "T", "rs123")
+    assert v1.key == ("chr1", 1000, "A", "T")
+    assert hash(v1) == hash(v1.key) == hash(Variant("chr1", 1000, "A", "T"))
+    assert not hasattr(v1, "__dict__")
+    assert not hasattr(Locus("chr1", 1000), "__dict__")
+
+
+def test_variant_mutation():
+    v1 = Variant("chr1", 1, "A", "G", "rs1")
+    assert v1.id == "1_1_A_G"
+    hash(v1)
+    v1.alt = "T"
+    assert v1.id == "1_1_A_T"
+    assert v1 == Variant("chr1", 1, "A", "T", "rs1")
+    assert hash(v1) == hash(Variant("chr1", 1, "A", "T", "rs1"))
+    assert v1 in {Variant("chr1", 1, "A", "T", "rs1")}
+
+
+def test_variant_str_subclass_chrom():
+    class Chrom(str):
+        pass
+
+    v1 = Variant(Chrom("chr1"), 1, "A", "G")
+    assert v1 == Variant("chr1", 1, "A", "G")
+    assert hash(v1) == hash(Variant("chr1", 1, "A", "G"))
+    assert Variant(None, 1, "A", "G").rsid is None
+
+
+def test_variant_pickle():
+    v1 = Variant("chr1", 1000, "A", "T", "rs123", genotype="T")
+    assert v1.id and hash(v1)
+    v2 = pickle.loads(pickle.dumps(v1))
+    assert v2 == v1 and v2.genotype == "T"
+    assert pickle.loads(pickle.dumps(Locus("chr1", 1))) == Locus("chr1", 1)
 
 
 @fixture(autouse=True)
@@ -86,3 +131,43 @@ def test_normalize_variant():
         ("AGT", "A"),
         ("A", "AGT"),
     ]
+
+
+def test_get_variants_is_cached(monkeypatch):
+    get_variants(["rs123", "rs000"])
+    monkeypatch.setattr(variants_module, "get_ddb_client", None)
+    # rs000 is not in build38, which is cached as well
+    assert get_variants(["rs123", "rs000"]) == {
+        "rs123": [Variant(chrom="chr1", pos=10000, ref="A", alt="G")]
+    }
+    assert variants_module.variants_cache.stats()["hits"] == 2
+
+
+def test_get_variants_cache_is_not_shared(monkeypatch):
+    # neither the list returned on a miss nor the one returned on a hit is cached
+    get_variants(["rs123"])["rs123"].clear()
+    monkeypatch.setattr(variants_module, "get_ddb_client", None)
+    get_variants(["rs123"])["rs123"].clear()
+    assert get_variants(["rs123"]) == {
+        "rs123": [Variant(chrom="chr1", pos=10000, ref="A", alt="G")]
+    }
+
+
+def test_normalize_variants():
+    pairs = [
+        ("A", "AG"),
+        ("A", "AGG"),
+        ("AGT", "A"),
+        ("AGT", "AGTGT"),
+        ("AGTGT", "AGT"),
+        ("AG", "G"),
+        ("CAT", "TGC"),
+        ("GTTT", "GTT"),
+    ]
+    refs, alts = normalize_variants(
+        pyarrow.array([ref for ref, _ in pairs]),
+        pyarrow.array([alt for _, alt in pairs]),
+    )
+    assert list(zip(refs.to_pylist(), alts.to_pylist())) == [
+        next(normalize_variant(ref, [alt])) for ref, alt in pairs
+    ]
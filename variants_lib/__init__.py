@@ -1,9 +1,13 @@
 from enum import Enum
-from dataclasses import dataclass
-from typing import Optional
+from dataclasses import dataclass, fields
+import sys
+from typing import Optional, Tuple
 
 VARIANT_ID_DELIMITER = "_"
 
+# (chrom, pos, ref, alt): what identifies a variant regardless of its rsid.
+VariantKey = Tuple[str, int, str, str]
+
 
 class VariationType(Enum):
     INDEL = "INDEL"
@@ -13,6 +17,31 @@ class VariationType(Enum):
     MNP = "MNP"  # Multi-Nucleotide Polymorphism (we haven't any yet.)
 
 
+def _slotted(cls, extra_slots: Tuple[str, ...] = ()):
+    """Recreate the given dataclass with __slots__ (what dataclass(slots=True) does
+    from python 3.10 on): the instances no longer carry a __dict__."""
+    field_names = tuple(field.name for field in fields(cls))
+    cls_dict = dict(cls.__dict__)
+    cls_dict["__slots__"] = field_names + extra_slots
+    for name in field_names:
+        # the defaults are already part of the generated __init__
+        cls_dict.pop(name, None)
+    cls_dict.pop("__dict__", None)
+    cls_dict.pop("__weakref__", None)
+
+    def __getstate__(self):
+        return [getattr(self, name) for name in field_names]
+
+    def __setstate__(self, state):
+        for name, value in zip(field_names, state):
+            # object.__setattr__ also works for frozen dataclasses
+            object.__setattr__(self, name, value)
+
+    cls_dict["__getstate__"] = __getstate__
+    cls_dict["__setstate__"] = __setstate__
+    return type(cls)(cls.__name__, cls.__bases__, cls_dict)
+
+
 @dataclass(frozen=True)
 class Locus:
     chrom: str
@@ -20,6 +49,9 @@ class Locus:
     rsid: Optional[str] = None
 
 
+Locus = _slotted(Locus)  # type: ignore  # pylint: disable=invalid-name
+
+
 @dataclass
 class Variant:
     chrom: str
@@ -29,6 +61,15 @@ class Variant:
     rsid: Optional[str] = None
     genotype: Optional[str] = None
 
+    # The id is cached in the _id slot along with the key it was computed from, so
+    # that it is recomputed if the variant is modified.
+    # pylint: disable=attribute-defined-outside-init
+
+    def __post_init__(self):
+        # str subclasses (e.g. numpy.str_) cannot be interned
+        if type(self.chrom) is str:  # pylint: disable=unidiomatic-typecheck
+            self.chrom = sys.intern(self.chrom)
+
     def __eq__(self, other) -> bool:
         if not isinstance(other, Variant):
             return False
@@ -37,14 +78,30 @@ class Variant:
         return self.id == other.id
 
     def __hash__(self) -> int:
-        return hash((self.chrom, self.pos, self.ref, self.alt))
+        # the strings cache their own hash, hashing the key is cheap
+        return hash(self.key)
+
+    @property
+    def key(self) -> VariantKey:
+        return (self.chrom, self.pos, self.ref, self.alt)
 
     @property
     def id(self) -> str:
+        key = self.key
+        # the slot is unset until the first call, and after unpickling
+        cached = getattr(self, "_id", None)
+        if cached is not None and cached[0] == key:
+            return cached[1]
         if not self.alt:
-            return ""
-        chrom = self.chrom.lstrip("chr")  # remove leading 'chr' if it exists
-        return VARIANT_ID_DELIMITER.join([chrom, str(self.pos), self.ref, self.alt])
+            id_ = ""
+        else:
+            chrom = self.chrom.lstrip("chr")  # remove leading 'chr' if it exists
+            id_ = VARIANT_ID_DELIMITER.join([chrom, str(self.pos), self.ref, self.alt])
+        self._id = (key, id_)
+        return id_
+
+
+Variant = _slotted(Variant, ("_id",))  # type: ignore  # pylint: disable=invalid-name
 
 
 # Use cases:
@@ -0,0 +1,133 @@
+"""asyncio flavour of the genotype lookup pipeline.
+
+boto3 and pyarrow are blocking libraries, so each DynamoDB lookup, each parquet scan
+and the formatting of the genotypes run in a thread pool dedicated to the lookups, of
+MAX_WORKERS threads unless another executor is set with set_executor. Independent
+lookups are awaited concurrently.
+
+Every coroutine can be cancelled or given a timeout, but that only stops the
+awaiting: a blocking call already running in the executor cannot be interrupted, it
+keeps its thread until it completes and its result is discarded."""
+import asyncio
+from concurrent.futures import Executor, ThreadPoolExecutor
+import logging
+import os
+from functools import lru_cache, partial
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar, Union
+from uuid import UUID
+
+from variants_lib import Locus, Variant, athena, merges
+from variants_lib import variants as variants_module
+
+T = TypeVar("T")
+
+# Size of the default thread pool running the blocking calls.
+MAX_WORKERS = int(os.environ.get("AIO_MAX_WORKERS", "32"))
+
+_executor: Optional[Executor] = None
+
+
+def set_executor(executor: Optional[Executor]) -> None:
+    """Run the blocking calls in the given executor, or in the default thread pool if
+    None. The executor stays owned (and shut down) by the caller."""
+    global _executor  # pylint: disable=global-statement
+    _executor = executor
+
+
+@lru_cache(maxsize=None)
+def _default_executor() -> Executor:
+    return ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="aio")
+
+
+def get_executor() -> Executor:
+    return _executor or _default_executor()
+
+
+async def _run(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), partial(func, *args, **kwargs))
+
+
+async def canonical_rsids(rsids: List[str]) -> Dict[str, str]:
+    """Return a dictionary mapping each provided rsid to the
+    corresponding most recent rsid."""
+    # merges.canonical_rsids already sends its ddb:BatchGetItem slices concurrently,
+    # on the pool of utils.batch_get_items.
+    return await _run(merges.canonical_rsids, rsids)
+
+
+async def get_variants(
+    rsids: List[str], normalized: bool = True
+) -> Dict[str, List[Variant]]:
+    return await _run(variants_module.get_variants, rsids, normalized=normalized)
+
+
+async def endow_rsid_with_variant(sites: List[Union[str, Variant]]) -> List[Variant]:
+    "See athena.endow_rsid_with_variant."
+    rsids = [site for site in sites if isinstance(site, str)]
+    provided_rsid_to_canonical_rsid: Dict[str, str] = {}
+    variants: Dict[str, List[Variant]] = {}
+    if rsids:
+        provided_rsid_to_canonical_rsid = await canonical_rsids(rsids)
+        variants = await get_variants(
+            list(dict.fromkeys(provided_rsid_to_canonical_rsid.values()))
+        )
+    return athena.attach_variants(sites, provided_rsid_to_canonical_rsid, variants)
+
+
+async def _get_genotypes_raw(
+    sites: List[Union[str, Variant]],
+    file_id: Union[UUID, str],
+) -> Optional[Dict[Variant, Tuple[Optional[int], Optional[int]]]]:
+    if not sites:
+        logging.warning("No sites specified.")
+        return {}
+    try:
+        athena._validate_sites(sites)  # pylint: disable=protected-access
+    except ValueError:
+        # as in athena, a file that has not been ingested takes precedence
+        if await _run(athena.get_parquet_path, file_id) is None:
+            logging.info("Genome file has not been ingested for file_id %s", file_id)
+            return None
+        raise
+
+    # The parquet path and the variants do not depend on each other.
+    s3_path, rsid_with_variant = await asyncio.gather(
+        _run(athena.get_parquet_path, file_id), endow_rsid_with_variant(sites)
+    )
+    if s3_path is None:
+        logging.info("Genome file has not been ingested for file_id %s", file_id)
+        return None
+    if not rsid_with_variant:
+        logging.info(
+            "No site (%s) could be matched to a variant.",
+            ", ".join(str(site) for site in sites),
+        )
+        return {}
+
+    dataset = await _run(athena.read_dataset, s3_path)
+    return await _run(athena.get_raw_gt, rsid_with_variant, dataset)
+
+
+async def get_genotypes_raw(
+    sites: List[Union[str, Variant]],
+    file_id: Union[UUID, str],
+    timeout: Optional[float] = None,
+) -> Optional[Dict[Variant, Tuple[Optional[int], Optional[int]]]]:
+    """See athena.get_genotypes_raw. Raise asyncio.TimeoutError if the lookup takes
+    more than `timeout` seconds; the blocking call running at that time still
+    completes in the background, see the module docstring."""
+    return await asyncio.wait_for(_get_genotypes_raw(sites, file_id), timeout)
+
+
+async def get_genotypes(
+    sites: List[Union[str, Variant]],
+    file_id: Union[UUID, str],
+    timeout: Optional[float] = None,
+) -> Optional[Dict[Locus, Tuple[Variant, Variant]]]:
+    """See athena.get_genotypes. Raise asyncio.TimeoutError if the lookup takes
+    more than `timeout` seconds."""
+    raw_genotypes = await get_genotypes_raw(sites, file_id, timeout)
+    if not raw_genotypes:
+        return raw_genotypes  # type: ignore
+    return await _run(athena.format_raw_gt, raw_genotypes)
@@ -1,27 +1,54 @@
 import dataclasses
 import logging
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from functools import lru_cache
 from uuid import UUID
 from typing import (
     Optional,
     List,
     Tuple,
     Dict,
+    Set,
     Union,
     TypedDict,
     Callable,
+    Iterator,
+    NamedTuple,
+    TypeVar,
 )
 import os
+import time
 
 import boto3
-from variants_lib import Variant, Locus
+from variants_lib import Variant, Locus, VariationType, file_cache, instrumentation
 from variants_lib.merges import canonical_rsids
 from variants_lib.variants import get_variants
-from variants_lib.format_variants import decode_indel
+from variants_lib.format_variants import (
+    ALLELE_AGGREGATES,
+    allele_columns,
+    decode_indel,
+    detect_variation_types,
+)
+from variants_lib.utils import LRUCache, batch_get_items
+import pyarrow.compute as pc
 import pyarrow.dataset as ds
 import pyarrow
 from pyarrow import fs
 
 TABLE_COLUMNS = ["chrom", "pos", "rsid", "ref", "alt", "gt1", "gt2"]
+# Schema of the columnar results, see get_raw_gt_table.
+RAW_GT_SCHEMA = pyarrow.schema(
+    [
+        ("chrom", pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+        ("pos", pyarrow.int64()),
+        ("rsid", pyarrow.string()),
+        ("ref", pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+        ("alt", pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+        ("gt1", pyarrow.int8()),
+        ("gt2", pyarrow.int8()),
+    ]
+)
 VariantWithGTDict = TypedDict(
     "VariantWithGTDict",
     {
@@ -34,38 +61,127 @@ VariantWithGTDict = TypedDict(
         "rsid": Optional[str],
     },
 )
+T = TypeVar("T")
 
 
-def _get_genome_file_etl_metadata_table():
-    genome_file_ddb = os.environ["USER_GENOME_FILE_ETL_DDB"]
-    table = boto3.resource("dynamodb").Table(genome_file_ddb)
-    return table
+# Resolved parquet paths keyed by file_id. Only fetchable files are cached: once a
+# file has been ingested its path does not change.
+PARQUET_PATH_CACHE_SIZE = int(os.environ.get("PARQUET_PATH_CACHE_SIZE", "4096"))
+PARQUET_PATH_CACHE_TTL = float(os.environ.get("PARQUET_PATH_CACHE_TTL", "300")) or None
+_parquet_paths = LRUCache(max_size=PARQUET_PATH_CACHE_SIZE, ttl=PARQUET_PATH_CACHE_TTL)
 
 
-def get_parquet_path(file_id: Union[UUID, str]) -> Optional[str]:
+@lru_cache(maxsize=None)
+def _get_dynamodb_client():
+    # shared by all the threads: unlike the boto3 resources, the clients are
+    # thread-safe
+    return boto3.client("dynamodb")
+
+
+def _parquet_path(file_id: str) -> str:
+    "Return the pyarrow backend parquet path of the file."
     user_genome_file_etl_bucket = os.environ["USER_GENOME_FILE_ETL_BUCKET"]
-    genome_file_ddb = _get_genome_file_etl_metadata_table()
-    resp = genome_file_ddb.get_item(Key={"file_id": str(file_id)})
-    item = resp["Item"]
-    if item.get("fetchable", False):
-        # return pyarrow backend parquet path
-        parquet_path = f'{user_genome_file_etl_bucket}/user_genome_files/parquets/file_id={item["file_id"]}'  # pylint: disable=line-too-long
+    return f"{user_genome_file_etl_bucket}/user_genome_files/parquets/file_id={file_id}"
+
+
+def _parquet_path_from_item(item: Dict) -> Optional[str]:
+    "Return the parquet path of an ETL metadata item (in the DynamoDB JSON format)."
+    if item.get("fetchable", {}).get("BOOL", False):
+        parquet_path = _parquet_path(item["file_id"]["S"])
     else:
         parquet_path = None
     return parquet_path
 
 
+def get_parquet_path(file_id: Union[UUID, str]) -> Optional[str]:
+    parquet_path = _parquet_paths.get(str(file_id))
+    if parquet_path is not None:
+        return parquet_path
+    with instrumentation.stage("etl_metadata"):
+        resp = _get_dynamodb_client().get_item(
+            TableName=os.environ["USER_GENOME_FILE_ETL_DDB"],
+            Key={"file_id": {"S": str(file_id)}},
+        )
+    item = resp["Item"]
+    parquet_path = _parquet_path_from_item(item)
+    if parquet_path is not None:
+        _parquet_paths.set(str(file_id), parquet_path)
+    return parquet_path
+
+
+def get_parquet_paths(file_ids: List[Union[UUID, str]]) -> Dict[str, Optional[str]]:
+    """Return a dictionary mapping each file_id (as a string) to its parquet path, or
+    to None if the file is not fetchable or unknown. The file_ids missing from the
+    cache are resolved with BatchGetItem, see batch_get_items."""
+    result: Dict[str, Optional[str]] = {}
+    missing: List[str] = []
+    for file_id in dict.fromkeys(map(str, file_ids)):
+        parquet_path = _parquet_paths.get(file_id)
+        result[file_id] = parquet_path
+        if parquet_path is None:
+            missing.append(file_id)
+    table_name = os.environ["USER_GENOME_FILE_ETL_DDB"]
+    with instrumentation.stage("etl_metadata"):
+        items = batch_get_items(_get_dynamodb_client(), table_name, "file_id", missing)
+    for item in items:
+        file_id = item["file_id"]["S"]
+        parquet_path = _parquet_path_from_item(item)
+        result[file_id] = parquet_path
+        if parquet_path is not None:
+            _parquet_paths.set(file_id, parquet_path)
+    return result
+
+
+def invalidate_parquet_path(file_id: Optional[Union[UUID, str]] = None) -> None:
+    """Forget the cached parquet path and dataset of the given file_id, or of every
+    file if None, e.g. after a user genome file was re-ingested."""
+    if file_id is None:
+        _parquet_paths.clear()
+        clear_dataset_cache()
+    else:
+        _parquet_paths.pop(str(file_id))
+        clear_dataset_cache(_parquet_path(str(file_id)))
+
+
 #
 #  Get data from parquet using pyarrow
 #
 
 
-def get_filter(variants: List[Variant]) -> pyarrow.compute.Expression:
+def get_filter(
+    variants: List[Variant], mode: str = "isin"
+) -> pyarrow.compute.Expression:
+    """Return a dataset filter selecting the rows at the loci of the given variants.
+    The default "isin" mode checks each row against one position set per chromosome;
+    the "or_chain" mode builds one (chrom, pos) term per variant and is kept for
+    benchmarking purposes."""
+    # we filter only using chrom and pos. this is more efficient than
+    # filtering on chrom, pos, ref, alt, by about 20%.
+    # filtering w.r.t ref/alt happens later
+    if mode == "isin":
+        return get_isin_filter(variants)
+    if mode == "or_chain":
+        return get_or_chain_filter(variants)
+    raise ValueError(f"Invalid filter mode: {mode}")
+
+
+def get_isin_filter(variants: List[Variant]) -> pyarrow.compute.Expression:
+    positions_by_chrom: Dict[str, Set[int]] = defaultdict(set)
+    for variant in variants:
+        positions_by_chrom[variant.chrom].add(variant.pos)
+    filter_expr = None
+    for chrom, positions in positions_by_chrom.items():
+        filter_ = (ds.field("chrom") == chrom) & ds.field("pos").isin(sorted(positions))
+        if filter_expr is None:
+            filter_expr = filter_
+        else:
+            filter_expr = filter_expr | filter_
+    return filter_expr
+
+
+def get_or_chain_filter(variants: List[Variant]) -> pyarrow.compute.Expression:
     filter_expr = None
     for variant in variants:
-        # we filter only using chrom and pos. this is more efficient than
-        # filtering on chrom, pos, ref, alt, by about 20%.
-        # filtering w.r.t ref/alt happens later
         filter_ = (ds.field("chrom") == variant.chrom) & (
             ds.field("pos") == variant.pos
         )
@@ -76,15 +192,110 @@ def get_filter(variants: List[Variant]) -> pyarrow.compute.Expression:
     return filter_expr
 
 
-def read_dataset(base_path: str) -> ds.Dataset:
-    s3_fs = fs.S3FileSystem(region="us-east-1")
-    return ds.dataset(
-        base_path,
-        format="parquet",
-        partitioning=ds.partitioning(flavor="hive"),
-        filesystem=s3_fs,
-        partition_base_dir=base_path,
-    )
+@lru_cache(maxsize=None)
+def get_s3_filesystem(region: str = "us-east-1") -> fs.S3FileSystem:
+    "Return the S3 filesystem for the given region, shared by all the datasets."
+    return fs.S3FileSystem(region=region)
+
+
+# Filesystem of the user genome files: "s3" (the USER_GENOME_FILE_ETL_BUCKET bucket),
+# "local" (USER_GENOME_FILE_ETL_BUCKET is then a local copy of the bucket) or the URI
+# of any filesystem supported by pyarrow, e.g. "s3://?region=eu-west-1".
+FILESYSTEM = os.environ.get("USER_GENOME_FILE_FILESYSTEM", "s3")
+
+
+@lru_cache(maxsize=None)
+def get_local_filesystem() -> fs.LocalFileSystem:
+    """Return the local filesystem. The files are memory-mapped, so that hot files are
+    read from the page cache without copies."""
+    return fs.LocalFileSystem(use_mmap=True)
+
+
+@lru_cache(maxsize=None)
+def _filesystem_from_uri(uri: str) -> fs.FileSystem:
+    filesystem, _ = fs.FileSystem.from_uri(uri)
+    return filesystem
+
+
+def get_filesystem(name: str) -> fs.FileSystem:
+    "Return the filesystem of the given name, see FILESYSTEM."
+    if name == "s3":
+        return get_s3_filesystem()
+    if name == "local":
+        return get_local_filesystem()
+    return _filesystem_from_uri(name)
+
+
+# Discovered datasets (fragments and parquet metadata) keyed by their base path.
+DATASET_CACHE_SIZE = int(os.environ.get("DATASET_CACHE_SIZE", "128"))
+# A dataset keeps the list of its files: the TTL bounds how long the scans of a
+# re-ingested file can fail.
+DATASET_CACHE_TTL = float(os.environ.get("DATASET_CACHE_TTL", "300")) or None
+_datasets = LRUCache(max_size=DATASET_CACHE_SIZE, ttl=DATASET_CACHE_TTL)
+
+
+def read_dataset(
+    base_path: str, filesystem: Optional[Union[str, fs.FileSystem]] = None
+) -> ds.Dataset:
+    """Return the dataset of the parquet files under base_path, on the given
+    filesystem (a name, see FILESYSTEM, or a pyarrow filesystem). Defaults to
+    FILESYSTEM. When the local disk cache is enabled (see file_cache), the files on
+    S3 are read from the cache."""
+    if filesystem is None:
+        filesystem = FILESYSTEM
+    cache = file_cache.get_file_cache() if filesystem == "s3" else None
+    local_dir = cache.get(base_path) if cache is not None else None
+    if local_dir is not None:
+        # not kept in _datasets, as other processes may evict the entry: the local
+        # discovery is cheap anyway
+        return ds.dataset(
+            local_dir,
+            format="parquet",
+            partitioning=ds.partitioning(flavor="hive"),
+            filesystem=get_local_filesystem(),
+            partition_base_dir=local_dir,
+        )
+    if isinstance(filesystem, str):
+        cache_key: Tuple = (base_path, filesystem)
+        filesystem = get_filesystem(filesystem)
+    else:
+        # the cached dataset references the filesystem, so its id is not reused
+        cache_key = (base_path, id(filesystem))
+    dataset = _datasets.get(cache_key)
+    if dataset is None:
+        with instrumentation.stage("dataset_discovery"):
+            dataset = ds.dataset(
+                base_path,
+                format="parquet",
+                partitioning=ds.partitioning(flavor="hive"),
+                filesystem=filesystem,
+                partition_base_dir=base_path,
+            )
+        _datasets.set(cache_key, dataset)
+    return dataset
+
+
+def clear_dataset_cache(base_path: Optional[str] = None) -> None:
+    """Forget the discovered datasets of base_path, or every dataset if None, e.g.
+    after a user genome file was re-ingested."""
+    if base_path is None:
+        _datasets.clear()
+        return
+    for cache_key in _datasets.keys():
+        if cache_key[0] == base_path:
+            _datasets.pop(cache_key)
+
+
+def scan_dataset(base_path: str, scan: Callable[[ds.Dataset], T]) -> T:
+    """Return scan(read_dataset(base_path)). If the scan fails with an OSError, e.g.
+    because the file was re-ingested since the dataset was discovered, the dataset is
+    discovered again and scanned once more."""
+    try:
+        return scan(read_dataset(base_path))
+    except OSError as exc:
+        logging.info("Scanning %s again after: %s", base_path, exc)
+        clear_dataset_cache(base_path)
+        return scan(read_dataset(base_path))
 
 
 def _validate_sites(sites: List[Union[str, Variant]]) -> None:
@@ -104,28 +315,30 @@ def endow_rsid_with_variant(sites: List[Union[str, Variant]]) -> List[Variant]:
     """Return a list computed by replacing each rsid with (rsid, variant) and each
     locus with (None, locus)."""
     rsids = [site for site in sites if isinstance(site, str)]
-    result: List[Variant] = []
     if rsids:
-        provided_rsid_to_canonical_rsid: Dict[str, str] = {}  # map
-        # the given rsids to the corresponding canonical rsids.
-
-        # We deal with slices of 100 rsids because that's the limit for
-        # ddb:BatchGetItem.
-        for i in range(0, len(rsids), 100):
-            rsids_slice = rsids[i : i + 100]
-            provided_rsid_to_canonical_rsid.update(**canonical_rsids(rsids_slice))
-
-        canonical_rsid_list = list(provided_rsid_to_canonical_rsid.values())
-
-        variants: Dict[str, List[Variant]] = {}  # map canonical rsids to variants
-        # Likewise we slice again for the same reason.
-        for i in range(0, len(canonical_rsid_list), 100):
-            canonical_rsid_slice = canonical_rsid_list[i : i + 100]
-            variants.update(**get_variants(canonical_rsid_slice))
+        instrumentation.count("rsids", len(rsids))
+        # map the given rsids to the corresponding canonical rsids. Both lookups
+        # send their ddb:BatchGetItem slices concurrently.
+        with instrumentation.stage("canonicalize"):
+            provided_rsid_to_canonical_rsid = canonical_rsids(rsids)
+        # map canonical rsids to variants
+        with instrumentation.stage("build38"):
+            variants = get_variants(list(provided_rsid_to_canonical_rsid.values()))
 
     else:  # Not used, we define them anyway to appease the static checkers.
         provided_rsid_to_canonical_rsid = {}
         variants = {}
+    return attach_variants(sites, provided_rsid_to_canonical_rsid, variants)
+
+
+def attach_variants(
+    sites: List[Union[str, Variant]],
+    provided_rsid_to_canonical_rsid: Dict[str, str],
+    variants: Dict[str, List[Variant]],
+) -> List[Variant]:
+    """Replace each rsid with its variants, given the canonical rsids and the
+    variants of the canonical rsids. Variant sites are kept as they are."""
+    result: List[Variant] = []
     for site in sites:
         if isinstance(site, Variant):
             result.append(site)
@@ -144,26 +357,86 @@ def endow_rsid_with_variant(sites: List[Union[str, Variant]]) -> List[Variant]:
 def get_raw_gt(
     variants: List[Variant],
     dataset: ds.Dataset,
+    filter_mode: str = "isin",
 ) -> Dict[Variant, Tuple[Optional[int], Optional[int]]]:
     """Get the raw genotypes for the given variants. Maps the variant to (gt1, gt2).
     For multiallelic variants, further processing is usually desirable.
     """
-    variants_with_gt_dict: List[VariantWithGTDict] = dataset.to_table(
-        columns=TABLE_COLUMNS, filter=get_filter(variants)
-    ).to_pylist()
-    # filter w.r.t ref/alt. more efficient to do it here than in the pyarrow dataset filtering
-    def filter_over_ref_alt(variant: VariantWithGTDict) -> bool:
-        return any(
-            variant_.chrom == variant["chrom"]
-            and variant_.pos == variant["pos"]
-            and variant_.ref == variant["ref"]
-            and variant_.alt == variant["alt"]
-            for variant_ in variants
-        )
+    with instrumentation.stage("scan"):
+        variants_with_gt_dict: List[VariantWithGTDict] = dataset.to_table(
+            columns=TABLE_COLUMNS, filter=get_filter(variants, filter_mode)
+        ).to_pylist()
+    instrumentation.count("rows_scanned", len(variants_with_gt_dict))
+    with instrumentation.stage("filter"):
+        # filter w.r.t ref/alt. more efficient to do it here than in the pyarrow dataset filtering
+        requested_keys = {variant.key for variant in variants}
+        variants_with_gt_dict = [
+            variant
+            for variant in variants_with_gt_dict
+            if (variant["chrom"], variant["pos"], variant["ref"], variant["alt"])
+            in requested_keys
+        ]
+        raw_gt = extract_gt(variants_with_gt_dict, variants)
+    instrumentation.count("rows_matched", len(variants_with_gt_dict))
+    return raw_gt
 
-    variants_with_gt_dict = list(filter(filter_over_ref_alt, variants_with_gt_dict))
 
-    return extract_gt(variants_with_gt_dict, variants)
+def get_raw_gt_table(
+    variants: List[Variant],
+    dataset: ds.Dataset,
+    filter_mode: str = "isin",
+) -> pyarrow.Table:
+    """Columnar flavour of get_raw_gt: return the rows of the given variants, with the
+    client-provided rsids substituted, as a table sorted by (chrom, pos) with the
+    RAW_GT_SCHEMA schema."""
+    with instrumentation.stage("scan"):
+        scanned = dataset.to_table(
+            columns=TABLE_COLUMNS, filter=get_filter(variants, filter_mode)
+        )
+    instrumentation.count("rows_scanned", scanned.num_rows)
+    # the join keys must have the same, plain (not dictionary-encoded) types on
+    # both sides
+    scanned = scanned.cast(
+        pyarrow.schema(
+            [
+                (field.name, field.type.value_type)
+                if pyarrow.types.is_dictionary(field.type)
+                else field
+                for field in RAW_GT_SCHEMA
+            ]
+        )
+    )
+    # one row per (chrom, pos, ref, alt), the last client rsid wins as in extract_gt
+    key_to_rsid = {variant.key: variant.rsid for variant in variants}
+    chroms, positions, refs, alts = zip(*key_to_rsid) if key_to_rsid else ([],) * 4
+    requested = pyarrow.table(
+        {
+            "chrom": pyarrow.array(chroms, pyarrow.string()),
+            "pos": pyarrow.array(positions, pyarrow.int64()),
+            "ref": pyarrow.array(refs, pyarrow.string()),
+            "alt": pyarrow.array(alts, pyarrow.string()),
+            "client_rsid": pyarrow.array(key_to_rsid.values(), pyarrow.string()),
+        }
+    )
+    # the join does the filtering w.r.t ref/alt
+    with instrumentation.stage("filter"):
+        joined = scanned.join(
+            requested, keys=["chrom", "pos", "ref", "alt"], join_type="inner"
+        )
+        joined = joined.sort_by([("chrom", "ascending"), ("pos", "ascending")])
+    instrumentation.count("rows_matched", joined.num_rows)
+    rsid = pc.coalesce(joined.column("client_rsid"), joined.column("rsid"))
+    return pyarrow.table(
+        {
+            "chrom": joined.column("chrom").dictionary_encode(),
+            "pos": joined.column("pos"),
+            "rsid": rsid,
+            "ref": joined.column("ref").dictionary_encode(),
+            "alt": joined.column("alt").dictionary_encode(),
+            "gt1": joined.column("gt1"),
+            "gt2": joined.column("gt2"),
+        }
+    ).cast(RAW_GT_SCHEMA)
 
 
 def variant_with_client_rsid(variant: Variant, client_rsid: Optional[str]) -> Variant:
@@ -182,32 +455,29 @@ def extract_gt(
 ) -> Dict[Variant, Tuple[Optional[int], Optional[int]]]:
     """Extract the genotypes from the variants_with_gt_dict."""
 
-    variant_to_rsid = {
-        forget_rsid(variant): variant.rsid for variant in rsid_with_variants
-    }
-
-    # We map the list of dict to a mapping {variant -> (gt1, gt2)}
-    variants_with_gt: Dict[Variant, Tuple[Optional[int], Optional[int]]] = {
-        Variant(
-            chrom=variant_dict["chrom"],
-            pos=variant_dict["pos"],
-            ref=variant_dict["ref"],
-            alt=variant_dict["alt"],
-            rsid=variant_dict.get("rsid"),
-        ): (
-            variant_dict["gt1"],
-            variant_dict["gt2"],
+    # rsids provided by the client, keyed by (chrom, pos, ref, alt) so that the
+    # rows can be looked up without building a Variant first.
+    key_to_rsid = {variant.key: variant.rsid for variant in rsid_with_variants}
+
+    # We map the list of dict to a mapping {variant -> (gt1, gt2)}, replacing the rsid
+    # from the parquet with the client-provided rsid when there is one.
+    variants_with_gt: Dict[Variant, Tuple[Optional[int], Optional[int]]] = {}
+    for variant_dict in variants_with_gt_dict:
+        key = (
+            variant_dict["chrom"],
+            variant_dict["pos"],
+            variant_dict["ref"],
+            variant_dict["alt"],
         )
-        for variant_dict in variants_with_gt_dict
-    }
-
-    # We go through the variants for which an rsid was provided by the client, and replace the
-    # rsid from the parquet with the client-provided rsid.
-
-    variants_with_gt = {
-        variant_with_client_rsid(variant, variant_to_rsid.get(forget_rsid(variant))): gt
-        for variant, gt in variants_with_gt.items()
-    }
+        client_rsid = key_to_rsid.get(key)
+        variant = Variant(
+            chrom=key[0],
+            pos=key[1],
+            ref=key[2],
+            alt=key[3],
+            rsid=variant_dict.get("rsid") if client_rsid is None else client_rsid,
+        )
+        variants_with_gt[variant] = (variant_dict["gt1"], variant_dict["gt2"])
 
     return variants_with_gt
 
@@ -244,7 +514,7 @@ def is_snp(variant: Tuple[str, str, Optional[int], Optional[int]]) -> bool:
 
 
 def format_raw_gt(
-    raw_gt: Dict[Variant, Tuple[Optional[int], Optional[int]]]
+    raw_gt: Dict[Variant, Tuple[Optional[int], Optional[int]]],
 ) -> Dict[Locus, Tuple[Variant, Variant]]:
     # We deal with the variants separately. Now a variant is a (chrom, pos, rsid). There are theoretically
     # some situations where a given locus has two different variants which cannot be discriminated
@@ -252,53 +522,181 @@ def format_raw_gt(
     # One way to do so would be to create a function which, given a number of variations (ref, alt)
     # at a given locus, would split these variations into subset corresponding to different logical variants.
     # This is likely overkill for the time being.
-    logical_variants = {
-        (variant.chrom, variant.pos, variant.rsid) for variant in raw_gt
-    }
-    result: Dict[Locus, Tuple[Variant, Variant]] = {}
 
-    logging.info("Found %d logical variants.", len(logical_variants))
-    for logical_variant in logical_variants:
-        # keep the variants matching the given logical variant
-        variants = [
-            (variant.ref, variant.alt, gt1, gt2)
-            for variant, (gt1, gt2) in raw_gt.items()
-            if (variant.chrom, variant.pos, variant.rsid) == logical_variant
-        ]
+    with instrumentation.stage("format"):
+        # group the variants by logical variant in a single pass over raw_gt
+        logical_variants: Dict[
+            Tuple[str, int, Optional[str]],
+            List[Tuple[str, str, Optional[int], Optional[int]]],
+        ] = defaultdict(list)
+        for variant, (gt1, gt2) in raw_gt.items():
+            logical_variants[(variant.chrom, variant.pos, variant.rsid)].append(
+                (variant.ref, variant.alt, gt1, gt2)
+            )
+        result: Dict[Locus, Tuple[Variant, Variant]] = {}
+
+        logging.info("Found %d logical variants.", len(logical_variants))
+        instrumentation.count("logical_variants", len(logical_variants))
+        for logical_variant, variants in logical_variants.items():
+            (ref1, alt1, gt1), (ref2, alt2, gt2) = format_genotype(variants)
+            v1 = Variant(
+                chrom=logical_variant[0],
+                pos=logical_variant[1],
+                ref=ref1,
+                alt=alt1,
+                rsid=logical_variant[2],
+                genotype=gt1,
+            )
+            v2 = Variant(
+                chrom=logical_variant[0],
+                pos=logical_variant[1],
+                ref=ref2,
+                alt=alt2,
+                rsid=logical_variant[2],
+                genotype=gt2,
+            )
+            result[Locus(*logical_variant)] = (v1, v2)
+    return result
+
+
+# Schema of the formatted columnar results, see format_raw_gt_table.
+FORMATTED_GT_SCHEMA = pyarrow.schema(
+    [
+        ("chrom", pyarrow.string()),
+        ("pos", pyarrow.int64()),
+        ("rsid", pyarrow.string()),
+        ("type", pyarrow.string()),
+        ("ref1", pyarrow.string()),
+        ("alt1", pyarrow.string()),
+        ("gt1", pyarrow.string()),
+        ("ref2", pyarrow.string()),
+        ("alt2", pyarrow.string()),
+        ("gt2", pyarrow.string()),
+    ]
+)
 
-        (ref1, alt1, gt1), (ref2, alt2, gt2) = format_genotype(variants)
-        v1 = Variant(
-            chrom=logical_variant[0],
-            pos=logical_variant[1],
-            ref=ref1,
-            alt=alt1,
-            rsid=logical_variant[2],
-            genotype=gt1,
+
+def format_raw_gt_table(raw_gt: pyarrow.Table) -> pyarrow.Table:
+    """Columnar flavour of format_raw_gt: take a table as returned by get_raw_gt_table
+    and return one row per logical variant (chrom, pos, rsid), with its variation
+    type and the (ref, alt, gt) formatted by format_genotype for each haplotype."""
+    if not raw_gt.num_rows:
+        return FORMATTED_GT_SCHEMA.empty_table()
+    ref = raw_gt.column("ref").cast(pyarrow.string())
+    alt = raw_gt.column("alt").cast(pyarrow.string())
+    # the row numbers identify the rows picked for each logical variant below
+    row = pyarrow.array(range(raw_gt.num_rows), pyarrow.int64())
+    no_row = pyarrow.scalar(None, pyarrow.int64())
+    rows = pyarrow.table(
+        {
+            "chrom": raw_gt.column("chrom").cast(pyarrow.string()),
+            "pos": raw_gt.column("pos"),
+            "rsid": raw_gt.column("rsid"),
+            "row": row,
+            **allele_columns(ref, alt),
+            "gt1": raw_gt.column("gt1"),
+            "gt2": raw_gt.column("gt2"),
+            "called1": pc.if_else(pc.equal(raw_gt.column("gt1"), 1), row, no_row),
+            "called2": pc.if_else(pc.equal(raw_gt.column("gt2"), 1), row, no_row),
+        }
+    )
+    groups = rows.group_by(["chrom", "pos", "rsid"]).aggregate(
+        [
+            ("row", "count"),
+            ("row", "min"),
+            *ALLELE_AGGREGATES,
+            ("gt1", "count"),
+            ("gt2", "count"),
+            ("called1", "min"),
+            ("called2", "min"),
+        ]
+    )
+    instrumentation.count("logical_variants", groups.num_rows)
+    first_row = groups.column("row_min")
+    variation_type = detect_variation_types(groups)
+    single_snp = pc.and_(
+        pc.equal(groups.column("row_count"), 1),
+        pc.equal(variation_type, VariationType.SNP.name),
+    )
+    first_ref = ref.take(first_row)
+    first_alt = alt.take(first_row)
+    formatted = {}
+    for haplotype in ("1", "2"):
+        # see format_genotype and decode_indel
+        gt = raw_gt.column("gt" + haplotype).take(first_row)
+        snp_gt = pc.if_else(
+            pc.is_null(gt),
+            ".",
+            pc.if_else(pc.equal(gt, 0), first_ref, first_alt),
+        )
+        called = groups.column("called" + haplotype + "_min")
+        called_ref = ref.take(called)
+        called_alt = alt.take(called)
+        reference_base = pc.utf8_slice_codeunits(first_ref, 0, 1)
+        no_call = pc.equal(groups.column("gt" + haplotype + "_count"), 0)
+        indel_ref = pc.if_else(
+            no_call, "", pc.if_else(pc.is_null(called), reference_base, called_ref)
         )
-        v2 = Variant(
-            chrom=logical_variant[0],
-            pos=logical_variant[1],
-            ref=ref2,
-            alt=alt2,
-            rsid=logical_variant[2],
-            genotype=gt2,
+        indel_alt = pc.if_else(
+            no_call, "", pc.if_else(pc.is_null(called), "", called_alt)
+        )
+        indel_gt = pc.if_else(
+            no_call,
+            "",
+            pc.if_else(
+                pc.is_null(called),
+                reference_base,
+                pc.if_else(
+                    pc.equal(variation_type, VariationType.SNP.name), called_alt, "I"
+                ),
+            ),
+        )
+        formatted["ref" + haplotype] = pc.if_else(single_snp, first_ref, indel_ref)
+        formatted["alt" + haplotype] = pc.if_else(single_snp, first_alt, indel_alt)
+        formatted["gt" + haplotype] = pc.if_else(single_snp, snp_gt, indel_gt)
+    return pyarrow.table(
+        {
+            "chrom": groups.column("chrom"),
+            "pos": groups.column("pos"),
+            "rsid": groups.column("rsid"),
+            "type": variation_type,
+            **formatted,
+        }
+    ).cast(FORMATTED_GT_SCHEMA)
+
+
+def formatted_gt_table_to_dict(
+    formatted_gt: pyarrow.Table,
+) -> Dict[Locus, Tuple[Variant, Variant]]:
+    "Convert the result of format_raw_gt_table to the result of format_raw_gt."
+    result: Dict[Locus, Tuple[Variant, Variant]] = {}
+    for row in formatted_gt.to_pylist():
+        locus = Locus(row["chrom"], row["pos"], row["rsid"])
+        result[locus] = tuple(  # type: ignore
+            Variant(
+                chrom=row["chrom"],
+                pos=row["pos"],
+                ref=row["ref" + haplotype],
+                alt=row["alt" + haplotype],
+                rsid=row["rsid"],
+                genotype=row["gt" + haplotype],
+            )
+            for haplotype in ("1", "2")
         )
-        result[Locus(*logical_variant)] = (v1, v2)
     return result
 
 
-def get_genotypes_raw(
+def _locate_variants(
     sites: List[Union[str, Variant]],
     file_id: Union[UUID, str],
-) -> Optional[Dict[Variant, Tuple[Optional[int], Optional[int]]]]:
-    if not sites:
-        logging.warning("No sites specified.")
-        return {}  # type: ignore
+) -> Tuple[Optional[str], List[Variant]]:
+    """Return the parquet path of the file (None if it has not been ingested) and the
+    variants to look up in it."""
     s3_path = get_parquet_path(file_id)
 
     if s3_path is None:
         logging.info("Genome file has not been ingested for file_id %s", file_id)
-        return None
+        return None, []
     _validate_sites(sites)
 
     # Get the variants (= chrom, pos, ref, alt) for the given rsids.
@@ -311,10 +709,43 @@ def get_genotypes_raw(
             "No site (%s) could be matched to a variant.",
             ", ".join(str(site) for site in sites),
         )
+    return s3_path, rsid_with_variant
+
+
+def get_genotypes_raw(
+    sites: List[Union[str, Variant]],
+    file_id: Union[UUID, str],
+) -> Optional[Dict[Variant, Tuple[Optional[int], Optional[int]]]]:
+    if not sites:
+        logging.warning("No sites specified.")
         return {}  # type: ignore
+    s3_path, rsid_with_variant = _locate_variants(sites, file_id)
+    if s3_path is None:
+        return None
+    if not rsid_with_variant:
+        return {}  # type: ignore
+
+    return scan_dataset(s3_path, lambda dataset: get_raw_gt(rsid_with_variant, dataset))
+
 
-    dataset = read_dataset(s3_path)  # lazy read
-    return get_raw_gt(rsid_with_variant, dataset)
+def get_genotypes_raw_table(
+    sites: List[Union[str, Variant]],
+    file_id: Union[UUID, str],
+) -> Optional[pyarrow.Table]:
+    """Columnar flavour of get_genotypes_raw: return the matching rows as a table with
+    the RAW_GT_SCHEMA schema, see get_raw_gt_table."""
+    if not sites:
+        logging.warning("No sites specified.")
+        return RAW_GT_SCHEMA.empty_table()
+    s3_path, rsid_with_variant = _locate_variants(sites, file_id)
+    if s3_path is None:
+        return None
+    if not rsid_with_variant:
+        return RAW_GT_SCHEMA.empty_table()
+
+    return scan_dataset(
+        s3_path, lambda dataset: get_raw_gt_table(rsid_with_variant, dataset)
+    )
 
 
 def get_genotypes(
@@ -324,3 +755,113 @@ def get_genotypes(
     if not raw_genotypes:
         return raw_genotypes  # type: ignore
     return format_raw_gt(raw_genotypes)
+
+
+#
+#  Cohort queries
+#
+
+
+class FileGenotypes(NamedTuple):
+    file_id: str
+    genotypes: Optional[Dict]  # same value as get_genotypes(_raw) for that file_id
+    error: Optional[BaseException] = None
+
+
+def _scan_file(
+    rsid_with_variant: List[Variant], parquet_path: str, raw: bool
+) -> Optional[Dict]:
+    raw_genotypes = scan_dataset(
+        parquet_path, lambda dataset: get_raw_gt(rsid_with_variant, dataset)
+    )
+    if raw or not raw_genotypes:
+        return raw_genotypes
+    return format_raw_gt(raw_genotypes)
+
+
+def get_genotypes_many(
+    sites: List[Union[str, Variant]],
+    file_ids: List[Union[UUID, str]],
+    max_workers: int = 8,
+    timeout: Optional[float] = None,
+    raw: bool = False,
+) -> Iterator[FileGenotypes]:
+    """Get the genotypes of the given sites for many files, yielding one FileGenotypes
+    per file_id as soon as it is available. The sites are resolved to variants once,
+    then the files are scanned concurrently by at most `max_workers` threads.
+
+    A scan taking more than `timeout` seconds is reported with a TimeoutError (the
+    thread cannot be interrupted and finishes in the background). Errors are
+    reported per file and do not interrupt the other scans. As with get_genotypes,
+    invalid sites are an error (a ValueError) only for the files that have been
+    ingested."""
+    file_ids = list(dict.fromkeys(map(str, file_ids)))
+    if not sites:
+        logging.warning("No sites specified.")
+        for file_id in file_ids:
+            yield FileGenotypes(file_id, {})
+        return
+    parquet_paths = get_parquet_paths(file_ids)
+    try:
+        _validate_sites(sites)
+    except ValueError as error:
+        for file_id in file_ids:
+            if parquet_paths[file_id] is None:
+                yield FileGenotypes(file_id, None)
+            else:
+                yield FileGenotypes(file_id, None, error)
+        return
+    rsid_with_variant = endow_rsid_with_variant(sites)
+    if not rsid_with_variant:
+        logging.info(
+            "No site (%s) could be matched to a variant.",
+            ", ".join(str(site) for site in sites),
+        )
+
+    started_at: Dict[str, float] = {}
+
+    def scan(file_id: str) -> Optional[Dict]:
+        started_at[file_id] = time.monotonic()
+        return _scan_file(rsid_with_variant, parquet_paths[file_id], raw)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures: Dict[Future, str] = {}
+    try:
+        for file_id in file_ids:
+            if parquet_paths[file_id] is None:
+                logging.info(
+                    "Genome file has not been ingested for file_id %s", file_id
+                )
+                yield FileGenotypes(file_id, None)
+            elif not rsid_with_variant:
+                yield FileGenotypes(file_id, {})
+            else:
+                futures[executor.submit(scan, file_id)] = file_id
+
+        poll_interval = None if timeout is None else min(timeout, 1.0)
+        pending = set(futures)
+        while pending:
+            done, pending = wait(
+                pending, timeout=poll_interval, return_when=FIRST_COMPLETED
+            )
+            for future in done:
+                file_id = futures[future]
+                error = future.exception()
+                if error is None:
+                    yield FileGenotypes(file_id, future.result())
+                else:
+                    yield FileGenotypes(file_id, None, error)
+            if timeout is None:
+                continue
+            now = time.monotonic()
+            for future in list(pending):
+                file_id = futures[future]
+                if file_id in started_at and now - started_at[file_id] > timeout:
+                    pending.remove(future)
+                    yield FileGenotypes(
+                        file_id, None, TimeoutError(f"Scan of {file_id} timed out")
+                    )
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
@@ -0,0 +1,287 @@
+"""Size-bounded local disk cache of the user genome files.
+
+Each user genome file (the parquet files under a `.../file_id=...` prefix) is
+downloaded into an entry of the cache directory, and read from there until one of
+its objects changes on S3, which is detected by comparing the ETags of a listing of
+the prefix. Each version of a file (a set of ETags) gets its own directory in the
+entry, and the `current` file of the entry names the version to read. The least
+recently used versions are evicted to keep the cache under its byte budget, and the
+replaced ones once they have not been used for EVICTION_GRACE seconds.
+
+Several processes can share the cache directory: versions are downloaded into a
+private temporary directory and installed by renaming it, and the installations and
+evictions are serialized by a lock file. An installed version is never modified, so
+the directory returned by get stays readable while other callers install newer
+versions."""
+from contextlib import contextmanager
+import fcntl
+from functools import lru_cache
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+import boto3
+
+from variants_lib import instrumentation
+
+# The cache is disabled unless USER_GENOME_FILE_CACHE_DIR is set.
+CACHE_DIR = os.environ.get("USER_GENOME_FILE_CACHE_DIR")
+CACHE_MAX_BYTES = int(os.environ.get("USER_GENOME_FILE_CACHE_MAX_BYTES", str(10 << 30)))
+# An entry validated less than VALIDATE_TTL seconds ago is used without listing its
+# prefix again.
+VALIDATE_TTL = float(os.environ.get("USER_GENOME_FILE_CACHE_VALIDATE_TTL", "300"))
+# Entries used less than EVICTION_GRACE seconds ago are not evicted, so that the
+# scans reading them can complete.
+EVICTION_GRACE = 60.0
+# Temporary directories left behind by crashed downloads are deleted after a day.
+STALE_TMP_AGE = 24 * 3600
+
+MANIFEST = "manifest.json"
+DATA = "data"
+CURRENT = "current"
+
+# relative path -> (ETag, size) of the objects of a user genome file
+Objects = Dict[str, Tuple[str, int]]
+
+
+@lru_cache(maxsize=None)
+def _get_s3_client():
+    return boto3.client("s3")
+
+
+def version_name(objects: Objects) -> str:
+    "Name of the directory holding the given version of a user genome file."
+    manifest = json.dumps(objects, sort_keys=True).encode()
+    return hashlib.sha256(manifest).hexdigest()[:16]
+
+
+def split_path(base_path: str) -> Tuple[str, str]:
+    "Split 'bucket/some/prefix' into the bucket and the prefix, with a trailing /."
+    bucket, _, prefix = base_path.strip("/").partition("/")
+    return bucket, prefix + "/"
+
+
+class FileCache:
+    "Read-through disk cache of the user genome files, see the module docstring."
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_bytes: int,
+        validate_ttl: float = VALIDATE_TTL,
+        eviction_grace: float = EVICTION_GRACE,
+        s3_client=None,
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.validate_ttl = validate_ttl
+        self.eviction_grace = eviction_grace
+        self.s3_client = s3_client
+        for name in ("entries", "tmp"):
+            os.makedirs(os.path.join(cache_dir, name), exist_ok=True)
+
+    def _client(self):
+        return self.s3_client or _get_s3_client()
+
+    def entry_dir(self, base_path: str) -> str:
+        key = hashlib.sha256(base_path.encode()).hexdigest()
+        return os.path.join(self.cache_dir, "entries", key)
+
+    @contextmanager
+    def _lock(self) -> Iterator[None]:
+        with open(os.path.join(self.cache_dir, "lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def list_objects(self, base_path: str) -> Objects:
+        bucket, prefix = split_path(base_path)
+        objects: Objects = {}
+        paginator = self._client().get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                if obj["Key"].endswith("/"):  # "directory" placeholders
+                    continue
+                objects[obj["Key"][len(prefix) :]] = (obj["ETag"], obj["Size"])
+        return objects
+
+    @staticmethod
+    def _read_manifest(entry_dir: str) -> Optional[Dict]:
+        try:
+            with open(os.path.join(entry_dir, MANIFEST)) as manifest:
+                return json.load(manifest)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _touch(version_dir: str, validated: bool) -> bool:
+        """Record a use (the mtime of the version directory) and, optionally, a
+        validation. Return False if the version was evicted in the meantime."""
+        try:
+            os.utime(version_dir)
+            if validated:
+                os.utime(os.path.join(version_dir, MANIFEST))
+        except FileNotFoundError:
+            return False
+        return True
+
+    @staticmethod
+    def _current_dir(entry_dir: str) -> Optional[str]:
+        "Return the directory of the current version of the entry, if any."
+        try:
+            with open(os.path.join(entry_dir, CURRENT)) as current:
+                return os.path.join(entry_dir, current.read())
+        except OSError:
+            return None
+
+    def _set_current(self, entry_dir: str, version_dir: str) -> None:
+        "Atomically make version_dir the current version of the entry."
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.cache_dir, "tmp"))
+        with os.fdopen(fd, "w") as current:
+            current.write(os.path.basename(version_dir))
+        os.replace(tmp_path, os.path.join(entry_dir, CURRENT))
+
+    def get(self, base_path: str) -> Optional[str]:
+        """Return the local directory holding the files under base_path, downloading
+        them if needed, or None if they do not fit in the cache."""
+        entry_dir = self.entry_dir(base_path)
+        version_dir = self._current_dir(entry_dir)
+        if version_dir is not None:
+            try:
+                validated_at = os.stat(os.path.join(version_dir, MANIFEST)).st_mtime
+            except FileNotFoundError:  # evicted
+                validated_at = 0.0
+            if time.time() - validated_at < self.validate_ttl and self._touch(
+                version_dir, validated=False
+            ):
+                instrumentation.count("file_cache_hits", 1)
+                return os.path.join(version_dir, DATA)
+        objects = self.list_objects(base_path)
+        version_dir = os.path.join(entry_dir, version_name(objects))
+        if self._touch(version_dir, validated=True):
+            # already installed, possibly by a concurrent caller
+            with self._lock():
+                if os.path.isdir(version_dir):
+                    instrumentation.count("file_cache_hits", 1)
+                    self._set_current(entry_dir, version_dir)
+                    return os.path.join(version_dir, DATA)
+        instrumentation.count("file_cache_misses", 1)
+        size = sum(size for _, size in objects.values())
+        if size > self.max_bytes:
+            logging.info("%s (%d bytes) is too large to be cached", base_path, size)
+            return None
+        with instrumentation.stage("file_cache_download"):
+            self._install(base_path, objects, size)
+        self.evict(keep=version_dir)
+        return os.path.join(version_dir, DATA)
+
+    def _install(self, base_path: str, objects: Objects, size: int) -> None:
+        bucket, prefix = split_path(base_path)
+        tmp_dir = tempfile.mkdtemp(dir=os.path.join(self.cache_dir, "tmp"))
+        try:
+            for path in objects:
+                filename = os.path.join(tmp_dir, DATA, path)
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+                self._client().download_file(bucket, prefix + path, filename)
+            with open(os.path.join(tmp_dir, MANIFEST), "w") as manifest:
+                json.dump(
+                    {"base_path": base_path, "objects": objects, "bytes": size},
+                    manifest,
+                )
+            entry_dir = self.entry_dir(base_path)
+            version_dir = os.path.join(entry_dir, version_name(objects))
+            with self._lock():
+                os.makedirs(entry_dir, exist_ok=True)
+                # a version installed by a concurrent caller is kept, the copy of
+                # this one is discarded
+                if not os.path.isdir(version_dir):
+                    os.rename(tmp_dir, version_dir)
+                self._set_current(entry_dir, version_dir)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _remove(self, path: str) -> None:
+        "Atomically remove the directory, then delete its files."
+        trash_dir = tempfile.mkdtemp(dir=os.path.join(self.cache_dir, "tmp"))
+        try:
+            os.rename(path, os.path.join(trash_dir, "entry"))
+        except FileNotFoundError:
+            pass
+        shutil.rmtree(trash_dir, ignore_errors=True)
+
+    def _versions(self) -> Iterator[Tuple[str, str, Dict]]:
+        "Yield the (entry directory, version directory, manifest) of the cache."
+        entries_dir = os.path.join(self.cache_dir, "entries")
+        for name in os.listdir(entries_dir):
+            entry_dir = os.path.join(entries_dir, name)
+            try:
+                versions = os.listdir(entry_dir)
+            except FileNotFoundError:
+                continue
+            for version in versions:
+                version_dir = os.path.join(entry_dir, version)
+                manifest = self._read_manifest(version_dir)
+                if manifest is not None:
+                    yield entry_dir, version_dir, manifest
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """Evict the replaced versions that are no longer used, and the least
+        recently used ones until the cache fits in its budget."""
+        with self._lock():
+            versions = []
+            total = 0
+            for entry_dir, version_dir, manifest in self._versions():
+                total += manifest["bytes"]
+                replaced = self._current_dir(entry_dir) != version_dir
+                versions.append(
+                    (
+                        not replaced,
+                        os.stat(version_dir).st_mtime,
+                        manifest["bytes"],
+                        entry_dir,
+                        version_dir,
+                    )
+                )
+            now = time.time()
+            tmp_dir = os.path.join(self.cache_dir, "tmp")
+            for name in os.listdir(tmp_dir):
+                path = os.path.join(tmp_dir, name)
+                try:
+                    if now - os.stat(path).st_mtime > STALE_TMP_AGE:
+                        shutil.rmtree(path, ignore_errors=True)
+                except FileNotFoundError:  # a download just completed
+                    pass
+            # the replaced versions first, then the least recently used
+            for current, used_at, size, entry_dir, version_dir in sorted(versions):
+                if current and total <= self.max_bytes:
+                    break
+                if version_dir == keep or now - used_at < self.eviction_grace:
+                    continue
+                self._remove(version_dir)
+                total -= size
+                instrumentation.count("file_cache_evictions", 1)
+                if os.listdir(entry_dir) == [CURRENT]:  # no version left
+                    self._remove(entry_dir)
+
+    def size(self) -> int:
+        "Return the total size of the cached files."
+        return sum(manifest["bytes"] for _, _, manifest in self._versions())
+
+
+@lru_cache(maxsize=None)
+def _open_file_cache(cache_dir: str, max_bytes: int) -> FileCache:
+    return FileCache(cache_dir, max_bytes)
+
+
+def get_file_cache() -> Optional[FileCache]:
+    "Return the cache configured by the environment, or None if it is disabled."
+    if not CACHE_DIR:
+        return None
+    return _open_file_cache(CACHE_DIR, CACHE_MAX_BYTES)
@@ -1,4 +1,7 @@
-from typing import List, Tuple, Optional
+from functools import lru_cache
+from typing import Dict, List, Sequence, Tuple, Optional
+import pyarrow
+import pyarrow.compute as pc
 from variants_lib import VariationType
 
 ### Format variants for user-friendly display
@@ -25,14 +28,112 @@ def detect_variation_type(refalt_alleles: List[Tuple[str, str]]) -> VariationTyp
     return VariationType.INDEL
 
 
+# Columnar flavour of detect_variation_type: allele_columns computes, for each
+# (ref, alt) row, the columns aggregated per locus with ALLELE_AGGREGATES (e.g. by
+# Table.group_by), and detect_variation_types classifies the loci from those
+# aggregates. detect_variation_types_from_offsets does all three steps.
+ALLELE_AGGREGATES = [
+    ("ref_length", "min"),
+    ("ref_length", "max"),
+    ("alt_length", "min"),
+    ("alt_length", "max"),
+    ("deletion", "min"),
+    ("insertion", "min"),
+]
+
+
+def allele_columns(
+    refs: pyarrow.Array, alts: pyarrow.Array
+) -> Dict[str, pyarrow.Array]:
+    ref_length = pc.utf8_length(refs)
+    alt_length = pc.utf8_length(alts)
+    return {
+        "ref_length": ref_length,
+        "alt_length": alt_length,
+        # For the two below columns we use the fact that variants are normalized
+        "deletion": pc.and_(
+            pc.equal(alt_length, 1),
+            pc.equal(pc.utf8_slice_codeunits(refs, 0, 1), alts),
+        ).cast(pyarrow.int8()),
+        "insertion": pc.and_(
+            pc.equal(ref_length, 1),
+            pc.equal(pc.utf8_slice_codeunits(alts, 0, 1), refs),
+        ).cast(pyarrow.int8()),
+    }
+
+
+def detect_variation_types(aggregates: pyarrow.Table) -> pyarrow.Array:
+    "Return the names of the variation types of the loci, see ALLELE_AGGREGATES."
+    ref_length_min = aggregates.column("ref_length_min")
+    same_length = pc.and_(
+        pc.and_(
+            pc.equal(ref_length_min, aggregates.column("ref_length_max")),
+            pc.equal(
+                aggregates.column("alt_length_min"), aggregates.column("alt_length_max")
+            ),
+        ),
+        pc.equal(ref_length_min, aggregates.column("alt_length_min")),
+    )
+    return pc.if_else(
+        same_length,
+        pc.if_else(
+            pc.equal(ref_length_min, 1),
+            VariationType.SNP.name,
+            VariationType.MNP.name,
+        ),
+        pc.if_else(
+            pc.equal(aggregates.column("deletion_min"), 1),
+            VariationType.DELETION.name,
+            pc.if_else(
+                pc.equal(aggregates.column("insertion_min"), 1),
+                VariationType.INSERTION.name,
+                VariationType.INDEL.name,
+            ),
+        ),
+    )
+
+
+def detect_variation_types_from_offsets(
+    refs: pyarrow.Array, alts: pyarrow.Array, offsets: Sequence[int]
+) -> pyarrow.Array:
+    """Return the names of the variation types of many loci at once. The alleles of
+    the i-th locus are the (ref, alt) rows offsets[i] to offsets[i + 1] (excluded);
+    every locus must have at least one allele."""
+    loci = pyarrow.ListArray.from_arrays(pyarrow.array(offsets, pyarrow.int32()), refs)
+    rows = pyarrow.table(
+        {"locus": pc.list_parent_indices(loci), **allele_columns(refs, alts)}
+    )
+    aggregates = rows.group_by(["locus"]).aggregate(ALLELE_AGGREGATES)
+    return detect_variation_types(aggregates.sort_by("locus"))
+
+
 def factor_sequence(sequence: str) -> Tuple[str, int]:
-    for length in range(1, len(sequence) // 2 + 1):
-        i = len(sequence) // length
-        if sequence == sequence[:length] * i:
-            return (sequence[:length], i)
+    """Return the shortest infix such that the sequence is the infix repeated count
+    times, and that count. Linear time: the smallest period of the sequence is
+    derived from its prefix function (the length of the longest proper prefix of
+    sequence[: i + 1] which is also a suffix of it), and any full repetition of the
+    sequence is a multiple of that period."""
+    if not sequence:
+        return (sequence, 1)
+    prefix = [0] * len(sequence)
+    for i in range(1, len(sequence)):
+        k = prefix[i - 1]
+        while k and sequence[i] != sequence[k]:
+            k = prefix[k - 1]
+        if sequence[i] == sequence[k]:
+            k += 1
+        prefix[i] = k
+    period = len(sequence) - prefix[-1]
+    if period < len(sequence) and len(sequence) % period == 0:
+        return (sequence[:period], len(sequence) // period)
     return (sequence, 1)
 
 
+# The same indels come up again and again when annotating many genotypes.
+DESCRIBE_ALT_CACHE_SIZE = 1 << 16
+
+
+@lru_cache(maxsize=DESCRIBE_ALT_CACHE_SIZE)
 def describe_alt(ref: str, alt: str) -> str:
     if len(ref) == 1 and len(alt) == 1:
         return alt
@@ -46,6 +147,22 @@ def describe_alt(ref: str, alt: str) -> str:
     return f"{verb}({infix})_{count}"
 
 
+def describe_alts(refs: pyarrow.Array, alts: pyarrow.Array) -> pyarrow.Array:
+    """Columnar flavour of describe_alt: return the description of each (ref, alt)
+    row, null where either allele is null. Each distinct row is described once."""
+    descriptions: Dict[Tuple[str, str], str] = {}
+    result: List[Optional[str]] = []
+    for ref, alt in zip(refs.to_pylist(), alts.to_pylist()):
+        if ref is None or alt is None:
+            result.append(None)
+            continue
+        description = descriptions.get((ref, alt))
+        if description is None:
+            description = descriptions[(ref, alt)] = describe_alt(ref, alt)
+        result.append(description)
+    return pyarrow.array(result, pyarrow.string())
+
+
 def decode_indel(
     rows: List[Tuple[str, str, Optional[int]]], factor=False
 ) -> Tuple[str, str, str]:
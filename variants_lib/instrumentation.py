@@ -0,0 +1,107 @@
+"""Per-stage timings and counters of the genotype lookups.
+
+The lookups report the duration of their stages (sts, canonicalize, build38,
+etl_metadata, dataset_discovery, scan, filter, format) and a few counters (rsids,
+ddb_batches, rows_scanned, rows_matched, logical_variants) to the sink set with
+set_sink. Nothing is measured while no sink is set, which is the default.
+
+Sinks are called from the threads doing the lookups, so they must be thread-safe."""
+import time
+from typing import Any, Callable, Optional
+
+
+class Sink:
+    "Receives the measurements. The default implementation discards them."
+
+    def timing(self, stage: str, seconds: float) -> None:
+        pass
+
+    def count(self, name: str, value: int) -> None:
+        pass
+
+
+class CallbackSink(Sink):
+    """Call `callback(kind, name, value)` for each measurement, kind being "timing"
+    (value in seconds) or "count"."""
+
+    def __init__(self, callback: Callable[[str, str, float], None]):
+        self.callback = callback
+
+    def timing(self, stage: str, seconds: float) -> None:
+        self.callback("timing", stage, seconds)
+
+    def count(self, name: str, value: int) -> None:
+        self.callback("count", name, value)
+
+
+class StatsdSink(Sink):
+    """Forward the measurements to a statsd client (e.g. statsd.StatsClient): the
+    durations with client.timing, in milliseconds, and the counters with client.incr.
+    The metric names are prefixed with `prefix`."""
+
+    def __init__(self, client: Any, prefix: str = "variants_lib"):
+        self.client = client
+        self.prefix = prefix
+
+    def timing(self, stage: str, seconds: float) -> None:
+        self.client.timing(f"{self.prefix}.{stage}", seconds * 1000)
+
+    def count(self, name: str, value: int) -> None:
+        self.client.incr(f"{self.prefix}.{name}", value)
+
+
+_sink: Optional[Sink] = None
+
+
+def set_sink(sink: Optional[Sink]) -> None:
+    "Send the measurements to the given sink, or stop measuring if None."
+    global _sink  # pylint: disable=global-statement
+    _sink = sink
+
+
+def get_sink() -> Optional[Sink]:
+    return _sink
+
+
+class _Stage:
+    __slots__ = ("name", "sink", "start")
+
+    def __init__(self, name: str, sink: Sink):
+        self.name = name
+        self.sink = sink
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.sink.timing(self.name, time.perf_counter() - self.start)
+
+
+class _NoStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name: str):
+    "Context manager reporting the duration of its block as the given stage."
+    sink = _sink
+    if sink is None:
+        return _NO_STAGE
+    return _Stage(name, sink)
+
+
+def count(name: str, value: int) -> None:
+    "Report the given counter."
+    sink = _sink
+    if sink is not None:
+        sink.count(name, value)
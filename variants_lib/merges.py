@@ -1,22 +1,81 @@
-from typing import List, Dict
+from typing import List, Dict, Hashable
+import logging
 import os
-from variants_lib.utils import get_ddb_client
+import sys
+from variants_lib.utils import (
+    LOOKUP_CACHE_MAX_BYTES,
+    LOOKUP_CACHE_SIZE,
+    LOOKUP_CACHE_TTL,
+    LRUCache,
+    batch_get_items,
+    get_ddb_client,
+)
 
 TABLE_NAME = os.environ.get("MERGES_TABLE", "merged-rsids")
+# Path of a local snapshot of the table (see merges_snapshot.export_merged_rsids),
+# used instead of the table while it is younger than SNAPSHOT_MAX_AGE seconds.
+SNAPSHOT_PATH = os.environ.get("MERGES_SNAPSHOT")
+SNAPSHOT_MAX_AGE = float(os.environ.get("MERGES_SNAPSHOT_MAX_AGE", str(7 * 24 * 3600)))
+
+
+def _cache_entry_size(rsid: Hashable, canonical_rsid: str) -> int:
+    # approximate: the two strings plus the bookkeeping of the cache entry
+    return sys.getsizeof(rsid) + sys.getsizeof(canonical_rsid) + 100
+
+
+# rsid -> canonical rsid
+canonical_rsids_cache = LRUCache(
+    max_size=LOOKUP_CACHE_SIZE,
+    ttl=LOOKUP_CACHE_TTL,
+    max_bytes=LOOKUP_CACHE_MAX_BYTES,
+    sizeof=_cache_entry_size,
+)
+
+
+def _get_snapshot():
+    if not SNAPSHOT_PATH:
+        return None
+    # imported here because merges_snapshot depends on this module
+    from variants_lib.merges_snapshot import (  # pylint: disable=import-outside-toplevel
+        open_merged_rsids_snapshot,
+    )
+
+    snapshot = open_merged_rsids_snapshot(SNAPSHOT_PATH)
+    if snapshot.age() > SNAPSHOT_MAX_AGE:
+        logging.warning(
+            "Merged rsids snapshot %s is stale, using %s.", SNAPSHOT_PATH, TABLE_NAME
+        )
+        return None
+    return snapshot
 
 
 def canonical_rsids(rsids: List[str]) -> Dict[str, str]:
     """Return a dictionary mapping each provided rsid to the
     corresponding most recent rsid."""
+    result: Dict[str, str] = {}
+    missing: List[str] = []
+    for rsid in rsids:
+        canonical_rsid = canonical_rsids_cache.get(rsid)
+        if canonical_rsid is None:
+            missing.append(rsid)
+        else:
+            result[rsid] = canonical_rsid
+    if missing:
+        fetched = _fetch_canonical_rsids(missing)
+        for rsid, canonical_rsid in fetched.items():
+            canonical_rsids_cache.set(rsid, canonical_rsid)
+        result.update(fetched)
+    return {rsid: result[rsid] for rsid in rsids}
+
+
+def _fetch_canonical_rsids(rsids: List[str]) -> Dict[str, str]:
+    snapshot = _get_snapshot()
+    if snapshot is not None:
+        return snapshot.canonical_rsids(rsids)
     client = get_ddb_client("merged-rsids")
-    payload = {TABLE_NAME: {"Keys": [{"rsid": {"S": rsid}} for rsid in rsids]}}
-    resp = client.batch_get_item(RequestItems=payload)
+    items = batch_get_items(client, TABLE_NAME, "rsid", rsids)
     result = {rsid: rsid for rsid in rsids}
-    try:
-        items = resp["Responses"][TABLE_NAME]
-    except KeyError:
-        # None of the rsids was found in the table (= no merge).
-        items = []
+    # rsids missing from the table were never merged.
     for item in items:
         if "merged_into" in item:
             result[item["rsid"]["S"]] = item["merged_into"]["S"]
@@ -0,0 +1,99 @@
+"""Local snapshot of the merged-rsids table.
+
+Only the merged rsids are kept, as a sorted int64 column (with the rsid they were
+merged into) in a memory-mapped Arrow IPC file. An rsid missing from that column is
+known not to have been merged, so it maps to itself without any network call."""
+
+from datetime import datetime, timezone
+from functools import lru_cache
+import os
+from typing import Dict, Iterable, List, Optional
+
+import pyarrow
+import pyarrow.compute as pc
+
+from variants_lib.merges import TABLE_NAME
+from variants_lib.reference_index import int64_view, lookup_rows, rsid_number
+from variants_lib.utils import get_ddb_client, scan_table
+
+SNAPSHOT_SCHEMA = pyarrow.schema(
+    [("rsid", pyarrow.int64()), ("merged_into", pyarrow.string())]
+)
+
+
+def write_snapshot(
+    items: Iterable[Dict], path: str, exported_at: Optional[datetime] = None
+) -> int:
+    """Write the merged rsids found in the given merged-rsids items (in the DynamoDB
+    JSON format) into a snapshot file. Return the number of merged rsids."""
+    rsids: List[int] = []
+    merged_into: List[str] = []
+    for item in items:
+        number = rsid_number(item["rsid"]["S"])
+        if number is None or "merged_into" not in item:
+            continue
+        rsids.append(number)
+        merged_into.append(item["merged_into"]["S"])
+    exported_at = exported_at or datetime.now(timezone.utc)
+    schema = SNAPSHOT_SCHEMA.with_metadata({"exported_at": exported_at.isoformat()})
+    table = pyarrow.table(
+        {
+            "rsid": pyarrow.array(rsids, pyarrow.int64()),
+            "merged_into": pyarrow.array(merged_into, pyarrow.string()),
+        },
+        schema=schema,
+    )
+    table = table.take(pc.sort_indices(table, sort_keys=[("rsid", "ascending")]))
+    with pyarrow.OSFile(path, "wb") as sink:
+        with pyarrow.ipc.new_file(sink, schema) as writer:
+            writer.write_table(table.combine_chunks(), max_chunksize=len(table) or None)
+    return len(table)
+
+
+def export_merged_rsids(path: str, total_segments: int = 8) -> int:
+    "Export the merged-rsids table into a snapshot file. Return the number of merges."
+    client = get_ddb_client("merged-rsids")
+    return write_snapshot(scan_table(client, TABLE_NAME, total_segments), path)
+
+
+class MergedRsidsSnapshot:
+    "Read-only, memory-mapped merged-rsids snapshot, see write_snapshot."
+
+    def __init__(self, path: str):
+        self.path = path
+        source = pyarrow.memory_map(path, "r")
+        self.table = pyarrow.ipc.open_file(source).read_all()
+        if self.table.column("rsid").num_chunks > 1:
+            self.table = self.table.combine_chunks()
+        self.exported_at = datetime.fromisoformat(
+            self.table.schema.metadata[b"exported_at"].decode()
+        )
+        self._rsids = int64_view(self.table.column("rsid"))
+
+    def __len__(self) -> int:
+        return len(self._rsids)
+
+    def age(self) -> float:
+        "Return the age of the snapshot, in seconds."
+        return (datetime.now(timezone.utc) - self.exported_at).total_seconds()
+
+    def canonical_rsids(self, rsids: List[str]) -> Dict[str, str]:
+        "See merges.canonical_rsids."
+        result = {rsid: rsid for rsid in rsids}
+        rows = lookup_rows(self._rsids, result)
+        if rows:
+            merged_into = self.table.column("merged_into").take(
+                pyarrow.array(list(rows.values()))
+            )
+            result.update(zip(rows, merged_into.to_pylist()))
+        return result
+
+
+@lru_cache(maxsize=4)
+def _open_snapshot(path: str, mtime: float) -> MergedRsidsSnapshot:
+    return MergedRsidsSnapshot(path)
+
+
+def open_merged_rsids_snapshot(path: str) -> MergedRsidsSnapshot:
+    "Return the snapshot at the given path, reloading it if the file was replaced."
+    return _open_snapshot(path, os.stat(path).st_mtime)
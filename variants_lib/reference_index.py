@@ -0,0 +1,313 @@
+"""Local, memory-mapped copy of the build38 reference table.
+
+The index is an uncompressed Arrow IPC file holding one row per rsid, sorted by the
+numeric part of the rsid. Opening it only maps the file: the sorted rsid column is
+binary searched in place and only the matching rows are materialized.
+
+The locus lookups use the same approach: the position_row column holds the
+permutation of the rows sorting them by (chrom, pos), the position_pos column the
+positions in that order and the chrom_spans metadata the range of each chromosome in
+it, so that the positions of a chromosome are binary searched in place as well."""
+
+from bisect import bisect_left
+from functools import lru_cache
+from itertools import islice
+import json
+import logging
+import os
+from threading import Lock
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import pyarrow
+import pyarrow.compute as pc
+
+from variants_lib import Locus, Variant
+from variants_lib.utils import get_ddb_client, scan_table
+from variants_lib.variants import TABLE_NAME, variants_from_alleles
+
+INDEX_SCHEMA = pyarrow.schema(
+    [
+        ("rsid", pyarrow.int64()),
+        # int16: the assemblies have a few thousand contigs at most (alt, decoys)
+        ("chrom", pyarrow.dictionary(pyarrow.int16(), pyarrow.string())),
+        ("pos", pyarrow.int64()),
+        ("ref", pyarrow.string()),
+        ("alt", pyarrow.list_(pyarrow.string())),
+        ("position_row", pyarrow.int64()),
+        ("position_pos", pyarrow.int64()),
+    ]
+)
+# the columns converted from the items, see items_batch
+ITEMS_SCHEMA = pyarrow.schema(
+    [INDEX_SCHEMA.field(name) for name in ["rsid", "chrom", "pos", "ref", "alt"]]
+)
+# Range of rows of each chromosome in the (chrom, pos) order.
+ChromSpans = Dict[str, Tuple[int, int]]
+WRITE_BATCH_SIZE = 64 * 1024
+
+
+def rsid_number(rsid: str) -> Optional[int]:
+    """Return 123 for 'rs123', or None if the rsid is not of that form. Only the
+    canonical form is accepted ('rs0123' is None), as the table would not find the
+    other ones."""
+    digits = rsid[2:]
+    if not (rsid.startswith("rs") and digits.isascii() and digits.isdigit()):
+        return None
+    number = int(digits)
+    return number if str(number) == digits else None
+
+
+def position_order(table: pyarrow.Table) -> pyarrow.Array:
+    "Return the permutation of the rows of the table sorting them by (chrom, pos)."
+    # the dictionary indices sort the rows of a chromosome together as well as the
+    # names, without materializing the names
+    chrom = table.column("chrom").combine_chunks()
+    by_position = pyarrow.table({"chrom": chrom.indices, "pos": table.column("pos")})
+    order = pc.sort_indices(
+        by_position, sort_keys=[("chrom", "ascending"), ("pos", "ascending")]
+    )
+    return order.cast(pyarrow.int64())
+
+
+def chrom_spans(table: pyarrow.Table, order: pyarrow.Array) -> ChromSpans:
+    "Return the range of each chromosome in the rows ordered by position_order."
+    chrom = table.column("chrom").combine_chunks()
+    spans: ChromSpans = {}
+    start = 0
+    # in a sorted array, the values are counted in sorted order
+    for count in pc.value_counts(chrom.indices.take(order)).to_pylist():
+        name = chrom.dictionary[count["values"]].as_py()
+        spans[name] = (start, start + count["counts"])
+        start += count["counts"]
+    return spans
+
+
+def items_batch(items: Iterable[Dict]) -> pyarrow.RecordBatch:
+    "Convert build38 items (in the DynamoDB JSON format) into a record batch."
+    columns: Dict[str, List] = {name: [] for name in ITEMS_SCHEMA.names}
+    for item in items:
+        number = rsid_number(item["rsid"]["S"])
+        if number is None:
+            logging.warning("Skipping unexpected rsid %s", item["rsid"]["S"])
+            continue
+        columns["rsid"].append(number)
+        columns["chrom"].append(item["chrom"]["S"])
+        columns["pos"].append(int(item["pos"]["N"]))
+        columns["ref"].append(item["ref"]["S"])
+        columns["alt"].append([alt["S"] for alt in item["alt"]["L"]])
+    return pyarrow.record_batch(
+        [
+            pyarrow.array(columns["rsid"], pyarrow.int64()),
+            pyarrow.array(columns["chrom"], pyarrow.string()).dictionary_encode(),
+            pyarrow.array(columns["pos"], pyarrow.int64()),
+            pyarrow.array(columns["ref"], pyarrow.string()),
+            pyarrow.array(columns["alt"], pyarrow.list_(pyarrow.string())),
+        ],
+        names=ITEMS_SCHEMA.names,
+    ).cast(ITEMS_SCHEMA)
+
+
+def write_index(items: Iterable[Dict], path: str) -> int:
+    """Write the given build38 items (in the DynamoDB JSON format, as returned by
+    Scan or found in a table export) into an index file. Return the number of rows.
+
+    The items are converted into record batches of WRITE_BATCH_SIZE rows as they
+    come, and the rows are then sorted on the Arrow columns."""
+    items = iter(items)
+    batches = []
+    while True:
+        chunk = list(islice(items, WRITE_BATCH_SIZE))
+        if not chunk:
+            break
+        batches.append(items_batch(chunk))
+    table = pyarrow.Table.from_batches(batches, schema=ITEMS_SCHEMA)
+    table = table.unify_dictionaries().combine_chunks()
+    table = table.take(pc.sort_indices(table, sort_keys=[("rsid", "ascending")]))
+    order = position_order(table)
+    spans = chrom_spans(table, order)
+    table = table.append_column("position_row", order)
+    table = table.append_column("position_pos", table.column("pos").take(order))
+    schema = INDEX_SCHEMA.with_metadata({"chrom_spans": json.dumps(spans)})
+    with pyarrow.OSFile(path, "wb") as sink:
+        with pyarrow.ipc.new_file(sink, schema) as writer:
+            # a single record batch keeps each column contiguous, which is what
+            # the binary search relies on.
+            writer.write_table(
+                table.combine_chunks().replace_schema_metadata(schema.metadata),
+                max_chunksize=len(table) or None,
+            )
+    return len(table)
+
+
+def scan_build38(total_segments: int = 8) -> Iterator[Dict]:
+    "Yield every item of the build38 table, using a parallel segmented Scan."
+    return scan_table(get_ddb_client("build38"), TABLE_NAME, total_segments)
+
+
+def export_build38(path: str, total_segments: int = 8) -> int:
+    "Export the build38 table into an index file. Return the number of rows."
+    return write_index(scan_build38(total_segments), path)
+
+
+def int64_view(column: pyarrow.ChunkedArray) -> memoryview:
+    "Zero-copy view over a single-chunk int64 column, suitable for bisect."
+    if not len(column):
+        return memoryview(b"").cast("q")
+    (array,) = column.chunks
+    return memoryview(array.buffers()[1])[
+        array.offset * 8 : (array.offset + len(array)) * 8
+    ].cast("q")
+
+
+def lookup_rows(sorted_numbers: memoryview, rsids: Iterable[str]) -> Dict[str, int]:
+    "Map each rsid found in the sorted rsid numbers to its row."
+    rows: Dict[str, int] = {}
+    for rsid in rsids:
+        number = rsid_number(rsid)
+        if number is None:
+            continue
+        row = bisect_left(sorted_numbers, number)
+        if row < len(sorted_numbers) and sorted_numbers[row] == number:
+            rows[rsid] = row
+    return rows
+
+
+class Build38Index:
+    "Read-only, memory-mapped build38 index, see write_index."
+
+    def __init__(self, path: str):
+        self.path = path
+        source = pyarrow.memory_map(path, "r")
+        self.table = pyarrow.ipc.open_file(source).read_all()
+        if self.table.column("rsid").num_chunks > 1:  # not written by write_index
+            self.table = self.table.combine_chunks()
+        self._rsids = int64_view(self.table.column("rsid"))
+        # positional index, built on the first locus lookup
+        self._positions_lock = Lock()
+        self._chrom_spans: Optional[Dict[str, Tuple[int, int]]] = None
+        self._sorted_positions = memoryview(b"").cast("q")
+        self._position_rows = memoryview(b"").cast("q")
+
+    def __len__(self) -> int:
+        return len(self._rsids)
+
+    def _take(self, rsids: List[str], columns: List[str]) -> Dict[str, Dict]:
+        rows = lookup_rows(self._rsids, rsids)
+        return dict(zip(rows, self._records(list(rows.values()), columns)))
+
+    def _records(self, rows: List[int], columns: List[str]) -> List[Dict]:
+        if not rows:
+            return []
+        return self.table.select(columns).take(pyarrow.array(rows)).to_pylist()
+
+    def _build_positions(self) -> None:
+        """Set up the positional index: each chromosome is a contiguous span of the
+        positions sorted by (chrom, pos), binary searched by the locus lookups."""
+        with self._positions_lock:
+            if self._chrom_spans is not None:
+                return
+            metadata = self.table.schema.metadata or {}
+            if b"chrom_spans" in metadata:
+                # memory-mapped, like the rsids
+                self._position_rows = int64_view(self.table.column("position_row"))
+                self._sorted_positions = int64_view(self.table.column("position_pos"))
+                self._chrom_spans = {
+                    chrom: (start, end)
+                    for chrom, (start, end) in json.loads(
+                        metadata[b"chrom_spans"]
+                    ).items()
+                }
+                return
+            # written before the positional index was stored: built in memory
+            order = position_order(self.table)
+            self._position_rows = int64_view(pyarrow.chunked_array([order]))
+            self._sorted_positions = int64_view(
+                pyarrow.chunked_array(
+                    [self.table.column("pos").take(order).combine_chunks()]
+                )
+            )
+            self._chrom_spans = chrom_spans(self.table, order)
+
+    def _position_range(self, chrom: str, start: int, end: int) -> List[int]:
+        "Return the rows whose position on the chromosome is in [start, end)."
+        if self._chrom_spans is None:
+            self._build_positions()
+        assert self._chrom_spans is not None
+        if chrom not in self._chrom_spans:
+            return []
+        low, high = self._chrom_spans[chrom]
+        first = bisect_left(self._sorted_positions, start, low, high)
+        last = bisect_left(self._sorted_positions, end, first, high)
+        return list(self._position_rows[first:last])
+
+    def _row_variants(self, rows: List[int], normalized: bool) -> List[List[Variant]]:
+        "Return the variants of each given row, with their rsids."
+        return [
+            variants_from_alleles(
+                record["chrom"],
+                record["pos"],
+                record["ref"],
+                record["alt"],
+                normalized,
+                rsid=f"rs{record['rsid']}",
+            )
+            for record in self._records(rows, ["rsid", "chrom", "pos", "ref", "alt"])
+        ]
+
+    def get_variants_at_loci(
+        self, loci: List[Locus], normalized=True
+    ) -> Dict[Locus, List[Variant]]:
+        "See variants.get_variants_at_loci."
+        locus_rows = {
+            locus: self._position_range(locus.chrom, locus.pos, locus.pos + 1)
+            for locus in loci
+        }
+        rows = list({row for rows in locus_rows.values() for row in rows})
+        # a single take for all the loci
+        row_variants = dict(zip(rows, self._row_variants(rows, normalized)))
+        return {
+            locus: [variant for row in rows for variant in row_variants[row]]
+            for locus, rows in locus_rows.items()
+            if rows
+        }
+
+    def get_variants_in_range(
+        self, chrom: str, start: int, end: int, normalized=True
+    ) -> List[Variant]:
+        "See variants.get_variants_in_range."
+        rows = self._position_range(chrom, start, end)
+        return [
+            variant
+            for variants in self._row_variants(rows, normalized)
+            for variant in variants
+        ]
+
+    def get_loci(self, rsids: List[str]) -> Dict[str, Locus]:
+        "See variants.get_loci."
+        return {
+            rsid: Locus(record["chrom"], record["pos"])
+            for rsid, record in self._take(rsids, ["chrom", "pos"]).items()
+        }
+
+    def get_variants(
+        self, rsids: List[str], normalized=True
+    ) -> Dict[str, List[Variant]]:
+        "See variants.get_variants."
+        return {
+            rsid: variants_from_alleles(
+                record["chrom"], record["pos"], record["ref"], record["alt"], normalized
+            )
+            for rsid, record in self._take(
+                rsids, ["chrom", "pos", "ref", "alt"]
+            ).items()
+        }
+
+
+@lru_cache(maxsize=4)
+def _open_index(path: str, mtime: float) -> Build38Index:
+    return Build38Index(path)
+
+
+def open_build38_index(path: str) -> Build38Index:
+    "Return the index at the given path, reloading it if the file was replaced."
+    return _open_index(path, os.stat(path).st_mtime)
@@ -1,14 +1,43 @@
-from typing import Literal
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from threading import Event, Lock
+import os
+import queue
+import random
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Tuple,
+)
 import boto3
+from variants_lib import instrumentation
 
 ROLE_MAPPING = {
     "build38": "dynamodb_crossaccount_readonlyaccess_role",
     "merged-rsids": "merged_rsids_crossaccount_readonlyaccess_role",
 }
 
+# Assumed-role credentials are renewed this long before they actually expire, so that
+# a client handed out right before the refresh still has time to complete its calls.
+CREDENTIALS_REFRESH_MARGIN = timedelta(minutes=5)
+
+# role -> (client, credentials expiration). Lives at module level so that the clients
+# (and their connection pools) survive across warm Lambda invocations.
+_ddb_clients: Dict[str, Tuple[Any, datetime]] = {}
+_ddb_clients_lock = Lock()
 
-def get_ddb_client(role: Literal["build38", "merged-rsids"]):
 
+def _assume_role_ddb_client(role: Literal["build38", "merged-rsids"]):
     sts_client = boto3.client("sts")
     sts_session = sts_client.assume_role(
         RoleArn=f"arn:aws:iam::308889746780:role/{ROLE_MAPPING[role]}",  # pylint: disable=line-too-long
@@ -22,4 +51,256 @@ def get_ddb_client(role: Literal["build38", "merged-rsids"]):
         aws_secret_access_key=credentials["SecretAccessKey"],
         aws_session_token=credentials["SessionToken"],
     )
-    return client
+    return client, credentials["Expiration"]
+
+
+def get_ddb_client(role: Literal["build38", "merged-rsids"]):
+    """Return a dynamodb client for the given role. Clients are cached per role and
+    shared by all threads; the role is assumed again only when the cached
+    credentials are about to expire."""
+    with _ddb_clients_lock:
+        cached = _ddb_clients.get(role)
+        if cached is not None:
+            client, expiration = cached
+            if datetime.now(timezone.utc) + CREDENTIALS_REFRESH_MARGIN < expiration:
+                return client
+        with instrumentation.stage("sts"):
+            client, expiration = _assume_role_ddb_client(role)
+        _ddb_clients[role] = (client, expiration)
+        return client
+
+
+def clear_ddb_clients() -> None:
+    "Drop the cached clients, forcing the roles to be assumed again on next use."
+    with _ddb_clients_lock:
+        _ddb_clients.clear()
+
+
+# ddb:BatchGetItem accepts at most 100 keys per request.
+BATCH_GET_SIZE = 100
+BATCH_GET_MAX_WORKERS = 8
+BATCH_GET_MAX_ATTEMPTS = 8
+BATCH_GET_BASE_DELAY = 0.05  # seconds
+BATCH_GET_MAX_DELAY = 2.0  # seconds
+
+
+def _batch_get_slice(
+    client, table_name: str, keys: List[Dict], max_attempts: int
+) -> List[Dict]:
+    items: List[Dict] = []
+    request: Dict = {table_name: {"Keys": keys}}
+    for attempt in range(max_attempts):
+        if attempt:
+            # exponential backoff with full jitter
+            delay = min(BATCH_GET_MAX_DELAY, BATCH_GET_BASE_DELAY * 2**attempt)
+            time.sleep(random.uniform(0, delay))
+        instrumentation.count("ddb_batches", 1)
+        resp = client.batch_get_item(RequestItems=request)
+        items += resp.get("Responses", {}).get(table_name, [])
+        request = resp.get("UnprocessedKeys")
+        if not request:
+            return items
+    raise RuntimeError(
+        f"{len(request[table_name]['Keys'])} keys still unprocessed "
+        f"by {table_name} after {max_attempts} attempts"
+    )
+
+
+@lru_cache(maxsize=None)
+def _batch_get_executor() -> Executor:
+    return ThreadPoolExecutor(
+        max_workers=BATCH_GET_MAX_WORKERS, thread_name_prefix="batch_get_items"
+    )
+
+
+def batch_get_items(
+    client,
+    table_name: str,
+    key_name: str,
+    keys: Iterable[str],
+    max_attempts: int = BATCH_GET_MAX_ATTEMPTS,
+    executor: Optional[Executor] = None,
+) -> List[Dict]:
+    """Return the items of the table whose string key `key_name` is one of `keys`.
+    The deduplicated keys are sent in slices of 100, concurrently on `executor`
+    (by default a pool of BATCH_GET_MAX_WORKERS threads shared by all the calls),
+    and the UnprocessedKeys are retried with jittered exponential backoff.
+
+    The executor must not be the one running the caller, which could deadlock."""
+    unique_keys = [{key_name: {"S": key}} for key in dict.fromkeys(keys)]
+    slices = [
+        unique_keys[i : i + BATCH_GET_SIZE]
+        for i in range(0, len(unique_keys), BATCH_GET_SIZE)
+    ]
+    if len(slices) <= 1:
+        results = [
+            _batch_get_slice(client, table_name, keys_slice, max_attempts)
+            for keys_slice in slices
+        ]
+    else:
+        results = list(
+            (executor or _batch_get_executor()).map(
+                lambda keys_slice: _batch_get_slice(
+                    client, table_name, keys_slice, max_attempts
+                ),
+                slices,
+            )
+        )
+    return [item for items in results for item in items]
+
+
+def scan_pages(
+    client, table_name: str, total_segments: int = 8
+) -> Iterator[List[Dict]]:
+    """Yield the items of each page of a parallel segmented Scan of the table, as the
+    pages arrive. At most 2 pages per segment are buffered."""
+    pages: queue.Queue = queue.Queue(maxsize=2 * total_segments)
+    stop = Event()
+
+    def put(page: Any) -> None:
+        # gives up once the consumer is gone
+        while not stop.is_set():
+            try:
+                pages.put(page, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def scan_segment(segment: int) -> None:
+        kwargs: Dict = {
+            "TableName": table_name,
+            "Segment": segment,
+            "TotalSegments": total_segments,
+        }
+        try:
+            while not stop.is_set():
+                resp = client.scan(**kwargs)
+                put(resp.get("Items", []))
+                if "LastEvaluatedKey" not in resp:
+                    break
+                kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+        except Exception as exc:  # pylint: disable=broad-except
+            put(exc)
+        put(None)
+
+    with ThreadPoolExecutor(max_workers=total_segments) as pool:
+        for segment in range(total_segments):
+            pool.submit(scan_segment, segment)
+        try:
+            remaining = total_segments
+            while remaining:
+                page = pages.get()
+                if page is None:
+                    remaining -= 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    yield page
+        finally:
+            stop.set()
+
+
+def scan_table(client, table_name: str, total_segments: int = 8) -> Iterator[Dict]:
+    "Yield every item of the table, using a parallel segmented Scan."
+    for page in scan_pages(client, table_name, total_segments):
+        yield from page
+
+
+# Settings of the in-process caches in front of the merged-rsids and build38 lookups.
+LOOKUP_CACHE_SIZE = int(os.environ.get("LOOKUP_CACHE_SIZE", "100000"))
+LOOKUP_CACHE_MAX_BYTES = int(os.environ.get("LOOKUP_CACHE_MAX_BYTES", str(64 << 20)))
+LOOKUP_CACHE_TTL = float(os.environ.get("LOOKUP_CACHE_TTL", "86400")) or None
+
+
+class LRUCache:
+    """Thread-safe mapping holding at most `max_size` entries, evicting the least
+    recently used one first. When `max_bytes` is set, the entries are also evicted
+    while their total size (as estimated by `sizeof(key, value)`) exceeds it. When
+    `ttl` (in seconds) is set, entries older than that are treated as missing."""
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+        sizeof: Optional[Callable[[Hashable, Any], int]] = None,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda key, value: 0)
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float, int]]" = OrderedDict()
+        self._lock = Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            try:
+                value, created_at, size = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if self.ttl is not None and time.monotonic() - created_at > self.ttl:
+                del self._entries[key]
+                self.bytes -= size
+                self.misses += 1
+                self.expirations += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        size = self.sizeof(key, value)
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries[key][2]
+            self._entries[key] = (value, time.monotonic(), size)
+            self._entries.move_to_end(key)
+            self.bytes += size
+            while len(self._entries) > self.max_size or (
+                self.max_bytes is not None and self.bytes > self.max_bytes
+            ):
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.bytes -= entry[2]
+
+    def keys(self) -> List[Hashable]:
+        "Return the keys of the entries, from the least recently used."
+        with self._lock:
+            return list(self._entries)
+
+    def clear(self) -> None:
+        "Drop every entry and reset the counters."
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.expirations = 0
+
+    def stats(self) -> Dict[str, int]:
+        "Return the counters of the cache, e.g. to size it."
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
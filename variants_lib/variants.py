@@ -1,25 +1,66 @@
 from collections import defaultdict
-from typing import Iterable, List, Dict, Tuple
+from typing import Iterable, List, Dict, Optional, Tuple
 import os
+import sys
+import pyarrow
+import pyarrow.compute as pc
 from variants_lib import Variant, Locus
-from variants_lib.utils import get_ddb_client
+from variants_lib.utils import (
+    LOOKUP_CACHE_MAX_BYTES,
+    LOOKUP_CACHE_SIZE,
+    LOOKUP_CACHE_TTL,
+    LRUCache,
+    batch_get_items,
+    get_ddb_client,
+)
 
 ### Get build38 coordinates and variants from rsid
 
 TABLE_NAME = os.environ.get("BUILD38_TABLE", "genome_reference_build38")
+# Path of a local build38 index (see reference_index.export_build38). When set, the
+# lookups are served from that file instead of the build38 table.
+INDEX_PATH = os.environ.get("BUILD38_INDEX")
+
+
+def _cache_entry_size(key: Tuple[str, bool], variants: Tuple[Variant, ...]) -> int:
+    # approximate: the rsid, plus the variants and their alleles, plus the
+    # bookkeeping of the cache entry
+    return (
+        sys.getsizeof(key[0])
+        + sum(250 + len(variant.ref) + len(variant.alt) for variant in variants)
+        + 150
+    )
+
+
+# (rsid, normalized) -> variants, as a tuple so that the callers cannot alter the
+# cached entries. rsids missing from build38 are cached too, with an empty tuple.
+variants_cache = LRUCache(
+    max_size=LOOKUP_CACHE_SIZE,
+    ttl=LOOKUP_CACHE_TTL,
+    max_bytes=LOOKUP_CACHE_MAX_BYTES,
+    sizeof=_cache_entry_size,
+)
+
+
+def _get_index():
+    if not INDEX_PATH:
+        return None
+    # imported here because reference_index depends on this module
+    from variants_lib.reference_index import (  # pylint: disable=import-outside-toplevel
+        open_build38_index,
+    )
+
+    return open_build38_index(INDEX_PATH)
 
 
 def get_loci(rsids: List[str]) -> Dict[str, Locus]:
     """Return a dictionary mapping rsid to Locus for those rsids that
     are found in the build38 table. If no rsid is found, return and empty dict."""
+    index = _get_index()
+    if index is not None:
+        return index.get_loci(rsids)
     client = get_ddb_client("build38")
-    resp = client.batch_get_item(
-        RequestItems={TABLE_NAME: {"Keys": [{"rsid": {"S": rsid}} for rsid in rsids]}}
-    )
-    try:
-        items = resp["Responses"][TABLE_NAME]
-    except KeyError:
-        return {}
+    items = batch_get_items(client, TABLE_NAME, "rsid", rsids)
     return {
         item["rsid"]["S"]: Locus(item["chrom"]["S"], int(item["pos"]["N"]))
         for item in items
@@ -27,14 +68,28 @@ def get_loci(rsids: List[str]) -> Dict[str, Locus]:
 
 
 def get_variants(rsids: List[str], normalized=True) -> Dict[str, List[Variant]]:
+    result: Dict[str, List[Variant]] = {}
+    missing: List[str] = []
+    for rsid in rsids:
+        variants = variants_cache.get((rsid, normalized))
+        if variants is None:
+            missing.append(rsid)
+        elif variants:
+            result[rsid] = list(variants)
+    if missing:
+        fetched = _fetch_variants(missing, normalized)
+        for rsid in missing:
+            variants_cache.set((rsid, normalized), tuple(fetched.get(rsid, ())))
+        result.update(fetched)
+    return result
+
+
+def _fetch_variants(rsids: List[str], normalized: bool) -> Dict[str, List[Variant]]:
+    index = _get_index()
+    if index is not None:
+        return index.get_variants(rsids, normalized)
     client = get_ddb_client("build38")
-    resp = client.batch_get_item(
-        RequestItems={TABLE_NAME: {"Keys": [{"rsid": {"S": rsid}} for rsid in rsids]}}
-    )
-    try:
-        items = resp["Responses"][TABLE_NAME]
-    except KeyError:
-        return {}
+    items = batch_get_items(client, TABLE_NAME, "rsid", rsids)
     result = defaultdict(list)
     for item in items:
         rsid, chrom, pos, ref, alts = (
@@ -44,20 +99,56 @@ def get_variants(rsids: List[str], normalized=True) -> Dict[str, List[Variant]]:
             item["ref"]["S"],
             [alt["S"] for alt in item["alt"]["L"]],
         )
-        if not normalized:
-            for alt in alts:
-                result[rsid].append(Variant(chrom=chrom, pos=pos, ref=ref, alt=alt))
-        else:
-            for normalized_ref, normalized_alt in normalize_variant(ref, alts):
-                result[rsid].append(
-                    Variant(
-                        chrom=chrom, pos=pos, ref=normalized_ref, alt=normalized_alt
-                    )
-                )
+        result[rsid] += variants_from_alleles(chrom, pos, ref, alts, normalized)
     return result
 
 
-# TODO: Implement (chrom, pos) -> List[Variant]
+def variants_from_alleles(
+    chrom: str,
+    pos: int,
+    ref: str,
+    alts: List[str],
+    normalized=True,
+    rsid: Optional[str] = None,
+) -> List[Variant]:
+    "Return the variants of a build38 entry, one per alternate allele."
+    if not normalized:
+        return [
+            Variant(chrom=chrom, pos=pos, ref=ref, alt=alt, rsid=rsid) for alt in alts
+        ]
+    return [
+        Variant(chrom=chrom, pos=pos, ref=normalized_ref, alt=normalized_alt, rsid=rsid)
+        for normalized_ref, normalized_alt in normalize_variant(ref, alts)
+    ]
+
+
+### Get build38 variants from (chrom, pos)
+# The build38 table is keyed by rsid, so these lookups need the local index.
+
+
+def _get_required_index():
+    index = _get_index()
+    if index is None:
+        raise RuntimeError(
+            "Locus lookups require a local build38 index (BUILD38_INDEX)"
+        )
+    return index
+
+
+def get_variants_at_loci(
+    loci: List[Locus], normalized=True
+) -> Dict[Locus, List[Variant]]:
+    """Return a dictionary mapping each locus to the build38 variants found at its
+    (chrom, pos), with their rsids. Loci without any variant are left out."""
+    return _get_required_index().get_variants_at_loci(loci, normalized)
+
+
+def get_variants_in_range(
+    chrom: str, start: int, end: int, normalized=True
+) -> List[Variant]:
+    """Return the build38 variants, with their rsids, whose position is in
+    [start, end), sorted by position."""
+    return _get_required_index().get_variants_in_range(chrom, start, end, normalized)
 
 
 def normalize_variant(ref: str, alts: List[str]) -> Iterable[Tuple[str, str]]:
@@ -69,3 +160,42 @@ def normalize_variant(ref: str, alts: List[str]) -> Iterable[Tuple[str, str]]:
         while ref[-(1 + k) :] == alt[-(1 + k) :]:
             k += 1
         yield (ref[: len(ref) - k], alt[: len(alt) - k])
+
+
+def normalize_variants(
+    refs: pyarrow.Array, alts: pyarrow.Array
+) -> Tuple[pyarrow.Array, pyarrow.Array]:
+    """Columnar flavour of normalize_variant, taking one (ref, alt) pair per row:
+    return the refs and alts with their common suffix removed."""
+    ref_length = pc.utf8_length(refs)
+    alt_length = pc.utf8_length(alts)
+    shortest = pc.min_element_wise(ref_length, alt_length)
+    # suffix[i] is the length of the common suffix of refs[i] and alts[i], computed
+    # one character at a time for the rows still matching (usually a few rounds).
+    suffix = pc.multiply(ref_length, 0)
+    matching = pc.greater(shortest, 0)
+    k = 1
+    while pc.any(matching).as_py():
+        matching = pc.and_(
+            matching,
+            pc.equal(
+                pc.utf8_slice_codeunits(refs, -k),
+                pc.utf8_slice_codeunits(alts, -k),
+            ),
+        )
+        suffix = pc.add(suffix, matching.cast(suffix.type))
+        k += 1
+        matching = pc.and_(matching, pc.greater_equal(shortest, k))
+    normalized_refs, normalized_alts = refs, alts
+    # the slice bounds are scalars, so the rows are trimmed by common suffix length
+    for length in pc.unique(suffix).to_pylist():
+        if not length:
+            continue
+        trimmed = pc.equal(suffix, length)
+        normalized_refs = pc.if_else(
+            trimmed, pc.utf8_slice_codeunits(refs, 0, -length), normalized_refs
+        )
+        normalized_alts = pc.if_else(
+            trimmed, pc.utf8_slice_codeunits(alts, 0, -length), normalized_alts
+        )
+    return normalized_refs, normalized_alts